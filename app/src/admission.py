@@ -0,0 +1,90 @@
+import math
+import time
+from collections import defaultdict, deque
+from typing import Callable, Dict, Optional, Tuple
+
+from config import (
+    ADMISSION_MAX_BACKLOG,
+    ADMISSION_DEPTH_TTL,
+    ADMISSION_THROUGHPUT_WINDOW,
+    ADMISSION_DEFAULT_RETRY_AFTER,
+)
+
+
+class QueueOverloaded(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"Queue is overloaded, retry after {retry_after} s")
+        self.retry_after = retry_after
+
+
+# Глубину очереди берём из пассивного объявления (не чаще раза в
+# depth_ttl секунд на очередь), а пропускную способность воркеров этой
+# очереди - из уведомлений о готовых задачах за последние window секунд.
+class AdmissionController:
+    def __init__(
+        self,
+        max_backlog: int,
+        depth_ttl: float,
+        window: float,
+        default_retry_after: int,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._max_backlog = max_backlog
+        self._depth_ttl = depth_ttl
+        self._window = window
+        self._default_retry_after = default_retry_after
+        self._clock = clock
+        self._depths: Dict[str, Tuple[float, int]] = {}
+        self._completions: Dict[str, deque] = defaultdict(deque)
+
+    def record_completion(self, queue: str) -> None:
+        self._completions[queue].append(self._clock())
+
+    def throughput(self, queue: str) -> float:
+        now = self._clock()
+        completions = self._completions[queue]
+        while completions and now - completions[0] > self._window:
+            completions.popleft()
+        return len(completions) / self._window
+
+    def estimate(self, queue: str, depth: int) -> Optional[float]:
+        throughput = self.throughput(queue)
+        if throughput == 0:
+            return None
+        return (depth + 1) / throughput
+
+    def check(self, queue: str, depth: int) -> Optional[float]:
+        # Возвращает ETA новой задачи или бросает QueueOverloaded
+        if depth >= self._max_backlog:
+            throughput = self.throughput(queue)
+            if throughput == 0:
+                retry_after = self._default_retry_after
+            else:
+                retry_after = math.ceil((depth - self._max_backlog + 1) / throughput)
+            raise QueueOverloaded(max(1, retry_after))
+        return self.estimate(queue, depth)
+
+    async def admit(self, publisher, queue: str) -> Optional[float]:
+        now = self._clock()
+        cached = self._depths.get(queue)
+        if cached is not None and now - cached[0] < self._depth_ttl:
+            depth = cached[1]
+        else:
+            depth, _ = await publisher.queue_stats(queue)
+            self._depths[queue] = (now, depth)
+        eta = self.check(queue, depth)
+        # Учитываем собственную задачу до следующего обновления глубины
+        self._depths[queue] = (self._depths[queue][0], depth + 1)
+        return eta
+
+
+admission = AdmissionController(
+    ADMISSION_MAX_BACKLOG,
+    ADMISSION_DEPTH_TTL,
+    ADMISSION_THROUGHPUT_WINDOW,
+    ADMISSION_DEFAULT_RETRY_AFTER,
+)
+
+
+def get_admission() -> AdmissionController:
+    return admission
@@ -1,3 +1,7 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
 from jose import jwt
 from datetime import datetime, timedelta, timezone
 from config import *
@@ -12,3 +16,42 @@ def create_access_token(data: dict) -> str:
         to_encode, auth_data["secret_key"], algorithm=auth_data["algorithm"]
     )
     return encode_jwt
+
+
+@dataclass(frozen=True)
+class Principal:
+    user_id: int
+    username: str
+    is_admin: bool
+    expires_at: datetime
+
+    @property
+    def is_expired(self) -> bool:
+        return self.expires_at < datetime.now(timezone.utc)
+
+
+# Уже проверенные токены: подпись проверяем один раз, а дальше
+# только смотрим, не истёк ли срок действия.
+class TokenCache:
+    def __init__(self, max_size: int):
+        self._max_size = max_size
+        self._principals: "OrderedDict[str, Principal]" = OrderedDict()
+
+    def get(self, token: str) -> Optional[Principal]:
+        principal = self._principals.get(token)
+        if principal is None:
+            return None
+        if principal.is_expired:
+            del self._principals[token]
+            return None
+        self._principals.move_to_end(token)
+        return principal
+
+    def put(self, token: str, principal: Principal) -> None:
+        self._principals[token] = principal
+        self._principals.move_to_end(token)
+        while len(self._principals) > self._max_size:
+            self._principals.popitem(last=False)
+
+
+token_cache = TokenCache(TOKEN_CACHE_SIZE)
@@ -0,0 +1,74 @@
+import os
+
+from transformers import T5ForConditionalGeneration
+
+from precision import prepare_model
+from registry import get_local_dir, resolve_model_path
+from config import (
+    ONNX_CACHE_DIR,
+    MODEL_PRECISION,
+    MODEL_PRECISION_CHECK,
+    MODEL_PRECISION_TOLERANCE,
+)
+
+
+def get_onnx_dir(model_path: str) -> str:
+    return os.path.join(ONNX_CACHE_DIR, model_path.replace("/", "--"))
+
+
+class TorchBackend:
+    def __init__(self, model_path: str, tokenizer):
+        local_dir = get_local_dir(model_path)
+        if os.path.isdir(local_dir):
+            # safetensors читаются через mmap, а low_cpu_mem_usage не
+            # создаёт сначала случайно инициализированную копию весов
+            model = T5ForConditionalGeneration.from_pretrained(
+                local_dir,
+                local_files_only=True,
+                use_safetensors=True,
+                low_cpu_mem_usage=True,
+            )
+        else:
+            model = T5ForConditionalGeneration.from_pretrained(
+                resolve_model_path(model_path), low_cpu_mem_usage=True
+            )
+        model.eval()
+        self.model = prepare_model(
+            model,
+            tokenizer,
+            MODEL_PRECISION,
+            check=MODEL_PRECISION_CHECK,
+            tolerance=MODEL_PRECISION_TOLERANCE,
+        )
+
+    def generate(self, **kwargs):
+        return self.model.generate(**kwargs)
+
+
+# Экспортированные энкодер и декодер (с past key values) под ONNX Runtime.
+# Артефакты готовятся заранее: python src/prepare_model.py export-onnx
+class OnnxBackend:
+    def __init__(self, model_path: str, tokenizer):
+        from optimum.onnxruntime import ORTModelForSeq2SeqLM
+
+        onnx_dir = get_onnx_dir(model_path)
+        if not os.path.isdir(onnx_dir):
+            raise FileNotFoundError(
+                f"No ONNX export for {model_path} in {onnx_dir}, "
+                f"run: python src/prepare_model.py export-onnx --model {model_path}"
+            )
+        self.model = ORTModelForSeq2SeqLM.from_pretrained(
+            onnx_dir, use_cache=True, provider="CPUExecutionProvider"
+        )
+
+    def generate(self, **kwargs):
+        return self.model.generate(**kwargs)
+
+
+BACKENDS = {"torch": TorchBackend, "onnx": OnnxBackend}
+
+
+def load_backend(name: str, model_path: str, tokenizer):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown model backend: {name}")
+    return BACKENDS[name](model_path, tokenizer)
@@ -0,0 +1,61 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+from dotenv import load_dotenv
+
+# По умолчанию бенчмарк ходит в ту же локальную базу, что и тесты;
+# переменные окружения и .env имеют приоритет
+BENCHMARK_ENV = {
+    "POSTGRES_HOST": "localhost",
+    "POSTGRES_PORT": "5433",
+    "POSTGRES_DB": "test-db",
+    "POSTGRES_USER": "test_user",
+    "POSTGRES_PASSWORD": "password",
+    "PROMPT_PRICE": "10",
+    "JWT_SECRET": "benchmark",
+    "JWT_ALGORITHM": "HS256",
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Load-test the API against an in-memory broker and a stub worker"
+    )
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--requests-per-user", type=int, default=5)
+    parser.add_argument("--worker-latency-ms", type=float, default=50)
+    parser.add_argument("--worker-batch-size", type=int, default=8)
+    parser.add_argument("--poll-interval-ms", type=float, default=20)
+    parser.add_argument("--poll-timeout", type=float, default=30)
+    parser.add_argument("--history-limit", type=int, default=20)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    load_dotenv()
+    for key, value in BENCHMARK_ENV.items():
+        os.environ.setdefault(key, value)
+    from benchmarks.runner import BenchmarkOptions, run_benchmark
+
+    options = BenchmarkOptions(
+        **{
+            key: value
+            for key, value in vars(args).items()
+            if key in BenchmarkOptions.__dataclass_fields__
+        }
+    )
+    report = asyncio.run(run_benchmark(options))
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
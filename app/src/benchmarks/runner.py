@@ -0,0 +1,170 @@
+import asyncio
+import math
+import time
+import uuid
+from collections import defaultdict
+from dataclasses import asdict, dataclass
+from typing import Awaitable, Callable, Dict, List
+
+import httpx
+
+from admission import admission
+from broker import get_publisher
+from database.database import init_schema, dispose_engines
+from database.async_database import dispose_async_engines
+from registry import MODELS
+from server import app
+from benchmarks.stubs import InMemoryBroker, StubWorker
+from config import get_url, PROMPT_PRICE
+
+
+@dataclass
+class BenchmarkOptions:
+    users: int = 50
+    concurrency: int = 10
+    requests_per_user: int = 5
+    worker_latency_ms: float = 50
+    worker_batch_size: int = 8
+    poll_interval_ms: float = 20
+    poll_timeout: float = 30
+    history_limit: int = 20
+
+
+def percentile(samples: List[float], q: float) -> float:
+    # Ближайший ранг: значение, не меньше которого q% замеров
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class Recorder:
+    def __init__(self, clock: Callable[[], float] = time.perf_counter):
+        self._clock = clock
+        self._samples: Dict[str, List[float]] = defaultdict(list)
+        self._errors: Dict[str, int] = defaultdict(int)
+
+    async def call(
+        self, name: str, request: Awaitable[httpx.Response]
+    ) -> httpx.Response:
+        started = self._clock()
+        response = await request
+        self.record(name, self._clock() - started, response.status_code < 400)
+        return response
+
+    def record(self, name: str, seconds: float, ok: bool = True) -> None:
+        self._samples[name].append(seconds * 1000)
+        if not ok:
+            self._errors[name] += 1
+
+    def report(self, duration: float) -> Dict[str, dict]:
+        return {
+            name: {
+                "count": len(samples),
+                "errors": self._errors[name],
+                "throughput_rps": round(len(samples) / duration, 2),
+                "mean_ms": round(sum(samples) / len(samples), 2),
+                "p50_ms": round(percentile(samples, 50), 2),
+                "p95_ms": round(percentile(samples, 95), 2),
+                "p99_ms": round(percentile(samples, 99), 2),
+            }
+            for name, samples in sorted(self._samples.items())
+        }
+
+
+# Один виртуальный пользователь проходит весь сценарий фронтенда:
+# регистрация, вход, пополнение, анекдоты с опросом результата и история
+async def run_user(
+    client: httpx.AsyncClient,
+    recorder: Recorder,
+    username: str,
+    options: BenchmarkOptions,
+) -> None:
+    user_data = {"username": username, "password": "benchmark"}
+    await recorder.call("POST /register", client.post("/register", json=user_data))
+    await recorder.call("POST /login", client.post("/login", json=user_data))
+    deposit = {"amount": PROMPT_PRICE * options.requests_per_user * 2}
+    await recorder.call("POST /deposit", client.post("/deposit", json=deposit))
+
+    for index in range(options.requests_per_user):
+        started = time.perf_counter()
+        response = await recorder.call(
+            "POST /anecdote",
+            client.post("/anecdote", json={"prompt": f"{username} joke {index}"}),
+        )
+        if response.status_code != 200:
+            continue
+        task_id = response.json()["task_id"]
+        if await poll_result(client, recorder, task_id, options):
+            recorder.record("anecdote end-to-end", time.perf_counter() - started)
+        else:
+            recorder.record("anecdote end-to-end", time.perf_counter() - started, False)
+
+    params = {"limit": options.history_limit}
+    await recorder.call("GET /balance", client.get("/balance"))
+    await recorder.call("GET /predictions", client.get("/predictions", params=params))
+    await recorder.call(
+        "GET /all_transactions", client.get("/all_transactions", params=params)
+    )
+
+
+async def poll_result(
+    client: httpx.AsyncClient,
+    recorder: Recorder,
+    task_id: str,
+    options: BenchmarkOptions,
+) -> bool:
+    deadline = time.perf_counter() + options.poll_timeout
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        response = await client.get(f"/anecdote/{task_id}")
+        # 400 здесь - «ещё не готово», а не ошибка
+        ok = response.status_code in (200, 400)
+        recorder.record("GET /anecdote/{task_id}", time.perf_counter() - started, ok)
+        if response.status_code == 200:
+            return True
+        await asyncio.sleep(options.poll_interval_ms / 1000)
+    return False
+
+
+async def run_benchmark(options: BenchmarkOptions) -> dict:
+    init_schema(get_url())
+    broker = InMemoryBroker()
+    app.dependency_overrides[get_publisher] = lambda: broker
+    worker = StubWorker(
+        broker,
+        {spec.queue for spec in MODELS.values()},
+        options.worker_latency_ms,
+        options.worker_batch_size,
+        admission,
+    )
+    worker_task = asyncio.create_task(worker.run())
+
+    recorder = Recorder()
+    semaphore = asyncio.Semaphore(options.concurrency)
+    transport = httpx.ASGITransport(app=app)
+    run_id = uuid.uuid4().hex[:8]
+
+    async def virtual_user(index: int) -> None:
+        async with semaphore:
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://benchmark"
+            ) as client:
+                await run_user(client, recorder, f"bench-{run_id}-{index}", options)
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(virtual_user(index) for index in range(options.users)))
+    finally:
+        duration = time.perf_counter() - started
+        worker_task.cancel()
+        app.dependency_overrides.pop(get_publisher, None)
+        await dispose_async_engines()
+        dispose_engines()
+
+    return {
+        "options": asdict(options),
+        "duration_s": round(duration, 3),
+        "endpoints": recorder.report(duration),
+    }
@@ -0,0 +1,141 @@
+import asyncio
+import itertools
+from collections import defaultdict
+from typing import AsyncIterator, Dict, Iterable, Optional, Tuple
+
+from admission import AdmissionController
+from broker import StreamNotFound
+from database.async_database import AsyncUserManager
+from config import get_async_url, TASK_QUEUE
+
+
+# Стрим одной задачи в памяти: события ждут в asyncio.Queue, пока клиент
+# не подключится, как в очереди стрима у RabbitMQ
+class InMemoryStream:
+    def __init__(
+        self, broker: "InMemoryBroker", stream_queue: str, events: asyncio.Queue
+    ):
+        self._broker = broker
+        self._stream_queue = stream_queue
+        self._events = events
+
+    async def iter_events(self, idle_timeout: float) -> AsyncIterator[dict]:
+        while True:
+            event = await asyncio.wait_for(self._events.get(), idle_timeout)
+            yield event
+            if event.get("done"):
+                break
+
+    async def close(self, delete: bool = False) -> None:
+        if delete:
+            self._broker.delete_stream(self._stream_queue)
+
+
+# Подменяет TaskPublisher в API: очереди живут в памяти процесса, задачи
+# с большим приоритетом выдаются первыми, как в очередях с x-max-priority
+class InMemoryBroker:
+    def __init__(self):
+        self._queues: Dict[str, asyncio.PriorityQueue] = defaultdict(
+            asyncio.PriorityQueue
+        )
+        self._consumers: Dict[str, int] = defaultdict(int)
+        self._streams: Dict[str, asyncio.Queue] = {}
+        self._order = itertools.count()
+
+    async def connect(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    async def publish(
+        self, task: dict, queue: str = TASK_QUEUE, priority: Optional[int] = None
+    ) -> None:
+        await self._queues[queue].put((-(priority or 0), next(self._order), task))
+
+    async def queue_stats(self, queue: str = TASK_QUEUE) -> Tuple[int, int]:
+        return self._queues[queue].qsize(), self._consumers[queue]
+
+    async def declare_stream(self, stream_queue: str) -> None:
+        self._streams.setdefault(stream_queue, asyncio.Queue())
+
+    async def open_stream(self, stream_queue: str) -> InMemoryStream:
+        if stream_queue not in self._streams:
+            raise StreamNotFound(stream_queue)
+        return InMemoryStream(self, stream_queue, self._streams[stream_queue])
+
+    def publish_stream_event(self, stream_queue: str, event: dict) -> None:
+        # Как и default exchange, событие для удалённого стрима теряется
+        events = self._streams.get(stream_queue)
+        if events is not None:
+            events.put_nowait(event)
+
+    def delete_stream(self, stream_queue: str) -> None:
+        self._streams.pop(stream_queue, None)
+
+    def add_consumer(self, queue: str) -> None:
+        self._consumers[queue] += 1
+
+    async def get(self, queue: str) -> dict:
+        _, _, task = await self._queues[queue].get()
+        return task
+
+    def get_nowait(self, queue: str) -> dict:
+        _, _, task = self._queues[queue].get_nowait()
+        return task
+
+
+# Воркер без модели: забирает задачи батчами, «думает» latency_ms на батч
+# и пишет ответ в базу так же, как настоящий воркер. Потоковым задачам
+# ответ уходит по словам, а финальное событие - после сохранения.
+class StubWorker:
+    def __init__(
+        self,
+        broker: InMemoryBroker,
+        queues: Iterable[str],
+        latency_ms: float,
+        batch_size: int,
+        admission: Optional[AdmissionController] = None,
+    ):
+        self._broker = broker
+        self._queues = list(queues)
+        self._latency = max(0, latency_ms) / 1000
+        self._batch_size = max(1, batch_size)
+        self._admission = admission
+
+    async def run(self) -> None:
+        for queue in self._queues:
+            self._broker.add_consumer(queue)
+        await asyncio.gather(*(self._consume(queue) for queue in self._queues))
+
+    async def _consume(self, queue: str) -> None:
+        while True:
+            batch = [await self._broker.get(queue)]
+            while len(batch) < self._batch_size:
+                try:
+                    batch.append(self._broker.get_nowait(queue))
+                except asyncio.QueueEmpty:
+                    break
+            await asyncio.sleep(self._latency)
+            for task in batch:
+                answer = f"Stub anecdote about {task['prompt']}"
+                stream_queue = task.get("stream_queue")
+                if stream_queue is not None:
+                    for word in answer.split():
+                        self._broker.publish_stream_event(
+                            stream_queue, {"chunk": f"{word} "}
+                        )
+                await AsyncUserManager.add_prediction(
+                    get_async_url(),
+                    task["id"],
+                    task["username"],
+                    answer,
+                    task["amount"],
+                    task.get("model_id"),
+                )
+                if stream_queue is not None:
+                    self._broker.publish_stream_event(
+                        stream_queue, {"done": True, "prediction": answer}
+                    )
+                if self._admission is not None:
+                    self._admission.record_completion(queue)
@@ -0,0 +1,168 @@
+import asyncio
+import json
+from typing import AsyncIterator, Optional, Set, Tuple
+
+import aio_pika
+from aio_pika.abc import (
+    AbstractRobustConnection,
+    AbstractChannel,
+    AbstractQueue,
+    AbstractIncomingMessage,
+)
+from aio_pika.exceptions import ChannelNotFoundEntity
+from aio_pika.pool import Pool
+
+from config import (
+    get_amqp_url,
+    TASK_QUEUE,
+    TASK_QUEUE_ARGUMENTS,
+    PUBLISHER_CHANNEL_POOL_SIZE,
+    PUBLISHER_CONFIRMS,
+    STREAM_QUEUE_PREFIX,
+    STREAM_QUEUE_TTL_MS,
+)
+
+
+def get_stream_queue_name(username: str, task_id: str) -> str:
+    # Имя пользователя в имени очереди не даёт читать чужой поток,
+    # даже зная task_id
+    return f"{STREAM_QUEUE_PREFIX}{username}.{task_id}"
+
+
+class StreamNotFound(Exception):
+    pass
+
+
+# Поток кусочков ответа для одной задачи. Очередь объявляется при
+# постановке задачи, поэтому то, что воркер успел отправить до
+# подключения клиента, не теряется.
+class TaskStream:
+    def __init__(self, channel: AbstractChannel, queue: AbstractQueue):
+        self._channel = channel
+        self._queue = queue
+
+    async def iter_events(self, idle_timeout: float) -> AsyncIterator[dict]:
+        messages: "asyncio.Queue[AbstractIncomingMessage]" = asyncio.Queue()
+        consumer_tag = await self._queue.consume(messages.put, no_ack=True)
+        try:
+            while True:
+                message = await asyncio.wait_for(messages.get(), idle_timeout)
+                event = json.loads(message.body)
+                yield event
+                if event.get("done"):
+                    break
+        finally:
+            await self._queue.cancel(consumer_tag)
+
+    async def close(self, delete: bool = False) -> None:
+        if delete:
+            await self._queue.delete(if_unused=False, if_empty=False)
+        await self._channel.close()
+
+
+# Одно долгоживущее соединение на процесс и пул каналов поверх него:
+# публикация задачи стоит одного round trip'а (плюс confirm, если включён),
+# а не нового TCP/AMQP-рукопожатия и повторного объявления очереди.
+class TaskPublisher:
+    def __init__(self, url: str, pool_size: int, confirms: bool = True):
+        self._url = url
+        self._pool_size = pool_size
+        self._confirms = confirms
+        self._connection: Optional[AbstractRobustConnection] = None
+        self._channels: Optional[Pool] = None
+        self._declared: Set[str] = set()
+        self._connect_lock: Optional[asyncio.Lock] = None
+
+    async def connect(self) -> None:
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self._connection is not None:
+                return
+            # connect_robust сам переподключается и восстанавливает каналы
+            self._connection = await aio_pika.connect_robust(self._url)
+            self._channels = Pool(self._open_channel, max_size=self._pool_size)
+
+    async def close(self) -> None:
+        if self._channels is not None:
+            await self._channels.close()
+            self._channels = None
+        if self._connection is not None:
+            await self._connection.close()
+            self._connection = None
+        self._declared.clear()
+
+    async def _open_channel(self) -> AbstractChannel:
+        return await self._connection.channel(publisher_confirms=self._confirms)
+
+    async def _declare(self, channel: AbstractChannel, queue: str) -> None:
+        if queue in self._declared:
+            return
+        await channel.declare_queue(
+            queue, durable=True, arguments=TASK_QUEUE_ARGUMENTS
+        )
+        self._declared.add(queue)
+
+    async def declare_stream(self, stream_queue: str) -> None:
+        if self._connection is None:
+            await self.connect()
+
+        async with self._channels.acquire() as channel:
+            await channel.declare_queue(
+                stream_queue, arguments={"x-expires": STREAM_QUEUE_TTL_MS}
+            )
+
+    async def open_stream(self, stream_queue: str) -> TaskStream:
+        if self._connection is None:
+            await self.connect()
+
+        channel = await self._connection.channel()
+        try:
+            queue = await channel.declare_queue(stream_queue, passive=True)
+        except ChannelNotFoundEntity:
+            raise StreamNotFound(stream_queue)
+        return TaskStream(channel, queue)
+
+    async def queue_stats(self, queue: str = TASK_QUEUE) -> Tuple[int, int]:
+        # Пассивное объявление ничего не создаёт, а только возвращает
+        # (число сообщений, число консьюмеров)
+        if self._connection is None:
+            await self.connect()
+
+        async with self._channels.acquire() as channel:
+            if channel.is_closed:
+                await channel.reopen()
+            try:
+                declared = await channel.declare_queue(queue, passive=True)
+            except ChannelNotFoundEntity:
+                return 0, 0
+            result = declared.declaration_result
+            return result.message_count, result.consumer_count
+
+    async def publish(
+        self, task: dict, queue: str = TASK_QUEUE, priority: Optional[int] = None
+    ) -> None:
+        if self._connection is None:
+            await self.connect()
+
+        async with self._channels.acquire() as channel:
+            if channel.is_closed:
+                await channel.reopen()
+            await self._declare(channel, queue)
+            await channel.default_exchange.publish(
+                aio_pika.Message(
+                    body=json.dumps(task).encode(),
+                    delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+                    priority=priority,
+                ),
+                routing_key=queue,
+            )
+
+
+publisher = TaskPublisher(
+    get_amqp_url(), PUBLISHER_CHANNEL_POOL_SIZE, confirms=PUBLISHER_CONFIRMS
+)
+
+
+def get_publisher() -> TaskPublisher:
+    return publisher
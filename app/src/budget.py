@@ -0,0 +1,61 @@
+from typing import Dict, Optional
+
+from config import (
+    GENERATION_MAX_NEW_TOKENS,
+    GENERATION_MIN_NEW_TOKENS,
+    GENERATION_MAX_TIME,
+    GENERATION_PRESSURE_BACKLOG,
+)
+
+
+# Бюджет генерации задачи: сколько токенов ответа и секунд на неё можно
+# потратить. Клиент может попросить меньше, но не больше политики сервера,
+# а когда очередь модели растёт, воркер урезает бюджет ещё сильнее.
+class GenerationPolicy:
+    def __init__(
+        self,
+        max_new_tokens: int,
+        min_new_tokens: int,
+        max_time: float,
+        pressure_backlog: int,
+    ):
+        self._max_new_tokens = max_new_tokens
+        self._min_new_tokens = min(min_new_tokens, max_new_tokens)
+        self._max_time = max_time
+        self._pressure_backlog = pressure_backlog
+
+    def for_request(
+        self,
+        max_new_tokens: Optional[int] = None,
+        latency_budget_ms: Optional[int] = None,
+    ) -> Dict[str, float]:
+        budget = {"max_new_tokens": self._max_new_tokens}
+        if max_new_tokens:
+            budget["max_new_tokens"] = min(max_new_tokens, self._max_new_tokens)
+        if latency_budget_ms:
+            budget["max_time"] = min(latency_budget_ms / 1000, self._max_time)
+        return budget
+
+    def for_task(self, task: dict, backlog: int = 0) -> Dict[str, float]:
+        budget = self.for_request(task.get("max_new_tokens"))
+        if "max_time" in task:
+            budget["max_time"] = min(task["max_time"], self._max_time)
+        if self._pressure_backlog <= 0 or backlog <= self._pressure_backlog:
+            return budget
+
+        # Бюджет сжимается обратно пропорционально очереди, а ограничение
+        # по времени обрывает генерацию, даже если модель не выдала EOS
+        shrunk = budget["max_new_tokens"] * self._pressure_backlog // backlog
+        budget["max_new_tokens"] = min(
+            budget["max_new_tokens"], max(self._min_new_tokens, shrunk)
+        )
+        budget["max_time"] = budget.get("max_time", self._max_time)
+        return budget
+
+
+generation_policy = GenerationPolicy(
+    max_new_tokens=GENERATION_MAX_NEW_TOKENS,
+    min_new_tokens=GENERATION_MIN_NEW_TOKENS,
+    max_time=GENERATION_MAX_TIME,
+    pressure_backlog=GENERATION_PRESSURE_BACKLOG,
+)
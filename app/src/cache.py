@@ -0,0 +1,110 @@
+import random
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+from config import (
+    PROMPT_CACHE_SIZE,
+    PROMPT_CACHE_TTL,
+    PROMPT_CACHE_POOL_SIZE,
+    PROMPT_CACHE_APPLY_TEMPLATE,
+)
+from prompts import PROMPT_TEMPLATE
+
+
+def normalize_prompt(prompt: str) -> str:
+    return " ".join(prompt.split()).casefold()
+
+
+class _Entry:
+    def __init__(self, created_at: float):
+        self.created_at = created_at
+        self.answers: List[str] = []
+
+
+# Кеш ответов по нормализованному промпту. На каждый ключ копится
+# небольшой пул сэмплов, и отдаём мы их только когда пул заполнен,
+# чтобы повторные ответы на одну и ту же просьбу всё-таки различались.
+class PromptCache:
+    def __init__(
+        self,
+        max_entries: int,
+        ttl: float,
+        pool_size: int,
+        template: Optional[str] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._pool_size = max(1, pool_size)
+        self._template = template
+        self._clock = clock
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        # task_id -> ключ для задач, ушедших в очередь после промаха
+        self._pending: "OrderedDict[str, str]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, prompt: str, model_id: int = 1) -> str:
+        if self._template is not None:
+            prompt = self._template.format(prompt=prompt)
+        return f"{model_id}:{normalize_prompt(prompt)}"
+
+    def _get_entry(self, key: str) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self._clock() - entry.created_at > self._ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get(self, prompt: str, model_id: int = 1) -> Optional[str]:
+        entry = self._get_entry(self.make_key(prompt, model_id))
+        if entry is None or len(entry.answers) < self._pool_size:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return random.choice(entry.answers)
+
+    def add(self, prompt: str, answer: str, model_id: int = 1) -> None:
+        self._add(self.make_key(prompt, model_id), answer)
+
+    def _add(self, key: str, answer: str) -> None:
+        entry = self._get_entry(key)
+        if entry is None:
+            entry = _Entry(self._clock())
+            self._entries[key] = entry
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+        if len(entry.answers) < self._pool_size:
+            entry.answers.append(answer)
+
+    def track(self, task_id: str, prompt: str, model_id: int = 1) -> None:
+        self._pending[task_id] = self.make_key(prompt, model_id)
+        while len(self._pending) > self._max_entries:
+            self._pending.popitem(last=False)
+
+    def resolve(self, task_id: str, answer: str) -> None:
+        key = self._pending.pop(task_id, None)
+        if key is not None:
+            self._add(key, answer)
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "pending": len(self._pending),
+        }
+
+
+prompt_cache = PromptCache(
+    PROMPT_CACHE_SIZE,
+    PROMPT_CACHE_TTL,
+    PROMPT_CACHE_POOL_SIZE,
+    template=PROMPT_TEMPLATE if PROMPT_CACHE_APPLY_TEMPLATE else None,
+)
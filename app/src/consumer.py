@@ -0,0 +1,429 @@
+import json
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from functools import partial
+from queue import Queue
+from threading import Thread
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import pika
+from loguru import logger
+
+from database.database import UserManager
+from registry import ModelPool
+from budget import GenerationPolicy, generation_policy
+from results import AckTracker, ResultWriter
+from retries import (
+    RETRY_COUNT_HEADER,
+    RetryPolicy,
+    get_dead_letter_queue,
+    retry_policy,
+)
+from config import (
+    get_url,
+    DEFAULT_MODEL_ID,
+    TASK_QUEUE_ARGUMENTS,
+    LENGTH_BUCKETS,
+    RESULT_FLUSH_SIZE,
+    RESULT_FLUSH_INTERVAL_MS,
+    CONSUMER_POLL_INTERVAL,
+)
+
+
+def get_bucket(n_tokens: int, bounds: List[int] = LENGTH_BUCKETS) -> int:
+    return bisect_left(bounds, n_tokens)
+
+
+# Собирает до batch_size сообщений (или ждёт не дольше max_wait_ms после
+# первого) и прогоняет их через модель одним вызовом generate. Слушает
+# очереди всех моделей из пула, батчи собираются отдельно по моделям,
+# а внутри модели - по корзинам длины промпта в токенах. Результаты
+# сохраняет и подтверждает ResultWriter, пока модель считает следующий батч.
+# Упавшие задачи повторяются с экспоненциальной задержкой, а после
+# последней попытки уходят в очередь мёртвых писем с возвратом денег.
+#
+# generate крутится в отдельном потоке, а поток pika только обслуживает
+# соединение (и heartbeat'ы) и собирает следующий батч. Канал pika не
+# потокобезопасен, поэтому всё, что трогает канал или AckTracker, поток
+# инференса передаёт обратно через add_callback_threadsafe.
+class BatchConsumer:
+    def __init__(
+        self,
+        connection,
+        channel,
+        models: ModelPool,
+        batch_size: int,
+        max_wait_ms: int,
+        policy: GenerationPolicy = generation_policy,
+        retries: RetryPolicy = retry_policy,
+    ):
+        self._connection = connection
+        self._channel = channel
+        self._models = models
+        self._batch_size = max(1, batch_size)
+        self._max_wait = max(0, max_wait_ms) / 1000
+        self._policy = policy
+        self._retries = retries
+        self._queues = {spec.model_id: spec.queue for spec in models.specs}
+        self._pending: List[tuple] = []
+        self._backlogs: Dict[str, int] = {}
+        # Задачи текущего батча, которые уже переданы дальше: в ResultWriter
+        # или потоку pika на подтверждение
+        self._handled: Set[int] = set()
+        self._first_at: Optional[float] = None
+        self._busy = False
+        self._batches: Queue = Queue()
+        self._inference = Thread(target=self._run_inference, name="inference")
+        self._tracker = AckTracker()
+        self._writer = ResultWriter(
+            connection,
+            channel,
+            self._tracker,
+            flush_size=RESULT_FLUSH_SIZE,
+            flush_interval_ms=RESULT_FLUSH_INTERVAL_MS,
+            on_failure=self._fail,
+        )
+
+    def start(self, on_ready: Optional[Callable[[], None]] = None) -> None:
+        # Ack приходит только после записи батча, поэтому prefetch
+        # вмещает и сохраняемый батч, и следующий
+        self._channel.basic_qos(prefetch_count=self._batch_size * 2)
+        for spec in self._models.specs:
+            # Очереди с x-max-priority: брокер отдаёт срочные задачи первыми
+            self._channel.queue_declare(
+                queue=spec.queue, durable=True, arguments=TASK_QUEUE_ARGUMENTS
+            )
+            self._declare_retry_queues(spec.queue)
+            self._channel.basic_consume(
+                queue=spec.queue, on_message_callback=self._on_message
+            )
+        self._writer.start()
+        self._inference.start()
+        if on_ready is not None:
+            on_ready()
+        try:
+            while True:
+                self._connection.process_data_events(time_limit=self._poll_timeout())
+                self._dispatch()
+        finally:
+            self._stop()
+
+    def _stop(self) -> None:
+        # Соединение закрыто: доделываем текущий батч (его ack'и уже
+        # не дойдут, задачи доставятся заново) и отпускаем потоки
+        self._batches.put(None)
+        self._inference.join()
+        self._writer.stop()
+
+    def _declare_retry_queues(self, queue: str) -> None:
+        for attempt in range(1, self._retries.max_attempts):
+            self._channel.queue_declare(
+                queue=self._retries.retry_queue(queue, attempt),
+                durable=True,
+                arguments=self._retries.retry_queue_arguments(queue, attempt),
+            )
+        self._channel.queue_declare(queue=get_dead_letter_queue(queue), durable=True)
+
+    def _on_message(self, ch, method, properties, body) -> None:
+        # Откуда пришла задача и с какими заголовками - нужно для повтора
+        self._tracker.track(method.delivery_tag, (method.routing_key, properties))
+        if not self._pending:
+            self._first_at = time.monotonic()
+        self._pending.append((method, properties, body))
+
+    def _poll_timeout(self) -> float:
+        if self._busy or not self._pending:
+            return CONSUMER_POLL_INTERVAL
+        remaining = self._first_at + self._max_wait - time.monotonic()
+        return min(CONSUMER_POLL_INTERVAL, max(0, remaining))
+
+    def _dispatch(self) -> None:
+        # Батч уходит в поток инференса, когда тот свободен и набралось
+        # batch_size сообщений (или первое ждёт уже max_wait_ms)
+        if self._busy or not self._pending:
+            return
+        waited = time.monotonic() - self._first_at
+        if len(self._pending) < self._batch_size and waited < self._max_wait:
+            return
+
+        batch = self._pending[: self._batch_size]
+        self._pending = self._pending[self._batch_size :]
+        self._first_at = time.monotonic() if self._pending else None
+        queues = {method.routing_key for method, _, _ in batch}
+        self._backlogs = {queue: self._backlog(queue) for queue in queues}
+        self._busy = True
+        self._batches.put(batch)
+
+    def _run_inference(self) -> None:
+        while True:
+            batch = self._batches.get()
+            if batch is None:
+                return
+            self._handled = set()
+            try:
+                self._process(batch)
+            except Exception as e:
+                logger.exception(e)
+                self._release(batch)
+            finally:
+                self._threadsafe(self._batch_done)
+
+    def _release(self, batch: List[tuple]) -> None:
+        # Батч упал мимо _fail: брошенные задачи держали бы ack'и всех
+        # следующих, поэтому отправляем их обычным путём ошибки - повтор,
+        # а после последней попытки возврат денег и очередь мёртвых писем
+        for method, _, body in batch:
+            delivery_tag = method.delivery_tag
+            if delivery_tag in self._handled:
+                continue
+            try:
+                self._fail(delivery_tag, json.loads(body))
+            except Exception as e:
+                logger.exception(e)
+                self._threadsafe(self._requeue, delivery_tag)
+
+    def _batch_done(self) -> None:
+        self._busy = False
+
+    def _threadsafe(self, callback: Callable, *args) -> None:
+        try:
+            self._connection.add_callback_threadsafe(partial(callback, *args))
+        except Exception as e:
+            # Соединение уже закрыто - неподтверждённые задачи брокер
+            # доставит заново
+            logger.warning(f"Dropped channel callback {callback.__name__}: {e!r}")
+
+    def _process(self, batch: List[tuple]) -> None:
+        tasks = []
+        redelivered = []
+        for method, _, body in batch:
+            delivery_tag = method.delivery_tag
+            try:
+                task = json.loads(body)
+            except ValueError:
+                logger.error(f"Malformed task message dropped: {body!r}")
+                self._threadsafe(self._reject, delivery_tag)
+                self._handled.add(delivery_tag)
+                continue
+            if method.redelivered:
+                redelivered.append((delivery_tag, task))
+            else:
+                tasks.append((delivery_tag, task))
+        tasks.extend(self._skip_completed(redelivered))
+
+        # Потоковые задачи идут по одной: им важнее первый токен,
+        # чем общий батч
+        batches = defaultdict(list)
+        streamed = []
+        for delivery_tag, task in tasks:
+            if "stream_queue" in task:
+                streamed.append((delivery_tag, task))
+            else:
+                batches[task.get("model_id", DEFAULT_MODEL_ID)].append(
+                    (delivery_tag, task)
+                )
+
+        for model_id, batched in batches.items():
+            try:
+                model = self._models.get(model_id)
+                buckets = self._bucket(model, batched, self._get_backlog(model_id))
+            except Exception as e:
+                logger.exception(e)
+                for delivery_tag, task in batched:
+                    self._fail(delivery_tag, task)
+                continue
+            for bucket in buckets:
+                self._predict(model, bucket)
+
+        for delivery_tag, task in streamed:
+            try:
+                model_id = task.get("model_id", DEFAULT_MODEL_ID)
+                budget = self._policy.for_task(task, self._get_backlog(model_id))
+                answer = self._stream(task, budget)
+            except Exception as e:
+                logger.exception(e)
+                self._fail(delivery_tag, task)
+            else:
+                self._complete(delivery_tag, task, answer, budget["max_new_tokens"])
+
+    def _skip_completed(self, tasks: List[Tuple[int, dict]]) -> List[Tuple[int, dict]]:
+        # Повторно доставленная задача (воркер упал до ack'а) могла уже
+        # сохраниться - такие подтверждаем без generate, остальные
+        # возвращаем на обработку
+        if not tasks:
+            return tasks
+        try:
+            completed = UserManager.get_completed_tasks(
+                get_url(), [task["id"] for _, task in tasks]
+            )
+        except Exception as e:
+            logger.exception(e)
+            return tasks
+        done = [
+            (delivery_tag, task, completed[task["id"]], None)
+            for delivery_tag, task in tasks
+            if task["id"] in completed
+        ]
+        if done:
+            logger.info(f"Skipping {len(done)} already completed tasks")
+            self._threadsafe(self._writer.acknowledge, done)
+            self._handled.update(delivery_tag for delivery_tag, *_ in done)
+        return [(tag, task) for tag, task in tasks if task["id"] not in completed]
+
+    def _get_backlog(self, model_id: int) -> int:
+        return self._backlogs.get(self._queues.get(model_id), 0)
+
+    def _backlog(self, queue: str) -> int:
+        # Сколько задач ещё ждут в очереди - по этому числу политика
+        # решает, урезать ли бюджет генерации. Вызывается в потоке pika.
+        result = self._channel.queue_declare(
+            queue=queue,
+            durable=True,
+            arguments=TASK_QUEUE_ARGUMENTS,
+            passive=True,
+        )
+        return result.method.message_count
+
+    # Раскладывает задачи по корзинам длины (и бюджета токенов), чтобы
+    # в одном generate короткие промпты не добивались паддингом
+    # до самого длинного
+    def _bucket(
+        self, model, batched: List[Tuple[int, dict]], backlog: int
+    ) -> List[list]:
+        buckets = defaultdict(list)
+        for delivery_tag, task in batched:
+            input_ids = task.get("input_ids") or model.encode(task["prompt"])
+            n_tokens = task.get("n_tokens", len(input_ids))
+            budget = self._policy.for_task(task, backlog)
+            key = (get_bucket(n_tokens), budget["max_new_tokens"])
+            buckets[key].append((delivery_tag, task, input_ids, budget))
+        return [buckets[key] for key in sorted(buckets)]
+
+    def _predict(self, model, bucket: List[tuple]) -> None:
+        max_new_tokens = bucket[0][3]["max_new_tokens"]
+        generation = {"max_new_tokens": max_new_tokens}
+        # Один generate на корзину, поэтому ограничение по времени
+        # берём самое строгое из задач корзины
+        max_times = [b["max_time"] for *_, b in bucket if "max_time" in b]
+        if max_times:
+            generation["max_time"] = min(max_times)
+        try:
+            answers = model.generate_batch(
+                [input_ids for _, _, input_ids, _ in bucket], **generation
+            )
+        except Exception as e:
+            logger.exception(e)
+            for delivery_tag, task, *_ in bucket:
+                self._fail(delivery_tag, task)
+        else:
+            for (delivery_tag, task, *_), answer in zip(bucket, answers):
+                self._complete(delivery_tag, task, answer, max_new_tokens)
+
+    def _stream(self, task: dict, budget: dict) -> str:
+        model = self._models.get(task.get("model_id", DEFAULT_MODEL_ID))
+        chunks = []
+        events = model.predict_stream(task["prompt"], task.get("input_ids"), **budget)
+        for chunk in events:
+            chunks.append(chunk)
+            self._threadsafe(
+                self._publish_stream_event, task["stream_queue"], {"chunk": chunk}
+            )
+        return "".join(chunks).strip()
+
+    def _publish_stream_event(self, stream_queue: str, event: dict) -> None:
+        self._channel.basic_publish(
+            exchange="", routing_key=stream_queue, body=json.dumps(event)
+        )
+
+    def _complete(
+        self,
+        delivery_tag: int,
+        task: dict,
+        answer: str,
+        max_new_tokens: Optional[int] = None,
+    ) -> None:
+        self._writer.submit(delivery_tag, task, answer, max_new_tokens)
+        self._handled.add(delivery_tag)
+
+    def _fail(self, delivery_tag: int, task: dict) -> None:
+        # Зовётся и из потока инференса, и из ResultWriter'а, если
+        # результат задачи так и не удалось сохранить
+        queue, properties = self._tracker.delivery(delivery_tag)
+        headers = dict(properties.headers or {})
+        attempt = headers.get(RETRY_COUNT_HEADER, 0) + 1
+        headers[RETRY_COUNT_HEADER] = attempt
+        retry = self._retries.should_retry(attempt)
+
+        if retry:
+            target = self._retries.retry_queue(queue, attempt)
+        else:
+            # Попытки кончились - возвращаем зарезервированные деньги.
+            # Если не удался и возврат, задача вернётся в очередь целиком.
+            target = get_dead_letter_queue(queue)
+            try:
+                UserManager.refund(
+                    get_url(), task["username"], -task["amount"], task["id"]
+                )
+            except Exception as e:
+                logger.exception(e)
+                self._threadsafe(self._requeue, delivery_tag)
+                self._handled.add(delivery_tag)
+                return
+
+        properties = pika.BasicProperties(
+            headers=headers,
+            priority=properties.priority,
+            delivery_mode=pika.spec.PERSISTENT_DELIVERY_MODE,
+        )
+        self._threadsafe(self._forward, delivery_tag, target, task, properties, retry)
+        self._handled.add(delivery_tag)
+
+        if not retry:
+            logger.error(f"Task {task['id']} dead-lettered after {attempt} attempts")
+            if "stream_queue" in task:
+                self._threadsafe(
+                    self._publish_stream_event,
+                    task["stream_queue"],
+                    {"done": True, "detail": "Task failed, the money was refunded"},
+                )
+
+    # Дальше - обработчики, которые выполняются в потоке pika. Задача не
+    # должна оставаться неподтверждённой: иначе она задержит ack'и всех
+    # следующих, а при prefetch'е - и весь консьюмер.
+
+    def _forward(
+        self, delivery_tag: int, target: str, task: dict, properties, retry: bool
+    ) -> None:
+        self._tracker.settle(delivery_tag)
+        try:
+            self._channel.basic_publish(
+                exchange="",
+                routing_key=target,
+                body=json.dumps(task),
+                properties=properties,
+            )
+        except Exception as e:
+            logger.exception(e)
+            if retry:
+                self._channel.basic_nack(delivery_tag=delivery_tag, requeue=True)
+                self._ack_watermark()
+                return
+        self._channel.basic_ack(delivery_tag=delivery_tag)
+        self._ack_watermark()
+
+    def _reject(self, delivery_tag: int) -> None:
+        self._tracker.settle(delivery_tag)
+        self._channel.basic_reject(delivery_tag=delivery_tag, requeue=False)
+        self._ack_watermark()
+
+    def _requeue(self, delivery_tag: int) -> None:
+        self._tracker.settle(delivery_tag)
+        self._channel.basic_nack(delivery_tag=delivery_tag, requeue=True)
+        self._ack_watermark()
+
+    def _ack_watermark(self) -> None:
+        # Отпущенная задача могла держать ack'и уже сохранённых за ней
+        watermark = self._tracker.complete([])
+        if watermark is not None:
+            self._channel.basic_ack(delivery_tag=watermark, multiple=True)
@@ -0,0 +1,221 @@
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, AsyncIterator, Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from .models import User, Transaction, Prediction
+from .pagination import paginate, split_page
+from .statements import (
+    build_balance_change,
+    build_prediction_upsert,
+    build_notify_payload,
+    build_refund,
+)
+from shemas.enums import TransactionType
+from config import (
+    STREAM_FETCH_SIZE,
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_POOL_RECYCLE,
+    RESULT_NOTIFY_CHANNEL,
+)
+
+# Асинхронные движки живут в event loop'е сервера, поэтому держим
+# их отдельно от синхронного реестра в database.py.
+_async_engines: Dict[str, AsyncEngine] = {}
+_async_session_factories: Dict[str, sessionmaker] = {}
+
+
+def get_async_engine(db_url: str) -> AsyncEngine:
+    engine = _async_engines.get(db_url)
+    if engine is None:
+        engine = create_async_engine(
+            db_url,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_pre_ping=True,
+        )
+        _async_session_factories[db_url] = sessionmaker(
+            bind=engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+        )
+        _async_engines[db_url] = engine
+    return engine
+
+
+def get_async_session_factory(db_url: str) -> sessionmaker:
+    get_async_engine(db_url)
+    return _async_session_factories[db_url]
+
+
+async def dispose_async_engines() -> None:
+    for engine in _async_engines.values():
+        await engine.dispose()
+    _async_engines.clear()
+    _async_session_factories.clear()
+
+
+class AsyncDatabase:
+    def __init__(self, db_url: str):
+        self._engine = get_async_engine(db_url)
+        self._Session = get_async_session_factory(db_url)
+
+    @asynccontextmanager
+    async def session_scope(self) -> AsyncGenerator[AsyncSession, None]:
+        session = self._Session()
+        try:
+            yield session
+            await session.commit()
+        except Exception as e:
+            await session.rollback()
+            raise e
+        finally:
+            await session.close()
+
+
+class AsyncUserManager(AsyncDatabase):
+    @classmethod
+    async def iter_all_users(cls, db_url: str) -> AsyncIterator[List[dict]]:
+        # Берём колонки, а не ORM-объекты, чтобы identity map не рос,
+        # и читаем серверным курсором пачками по STREAM_FETCH_SIZE
+        user_manager = cls(db_url)
+        async with user_manager.session_scope() as session:
+            result = await session.stream(
+                select(User.id, User.username, User.balance, User.is_admin)
+                .order_by(User.id)
+                .execution_options(max_row_buffer=STREAM_FETCH_SIZE)
+            )
+            async for rows in result.mappings().partitions(STREAM_FETCH_SIZE):
+                yield [dict(row) for row in rows]
+
+    @classmethod
+    async def get_balance(cls, db_url: str, username: str) -> Any:
+        user_manager = cls(db_url)
+        async with user_manager.session_scope() as session:
+            balance = await session.scalar(
+                select(User.balance).where(User.username == username)
+            )
+            return balance
+
+    @classmethod
+    async def change_balance(cls, db_url: str, username: str, amount: float) -> None:
+        user_manager = cls(db_url)
+        async with user_manager.session_scope() as session:
+            user = await session.scalar(
+                select(User).where(User.username == username).with_for_update()
+            )
+            if user:
+                if user.balance + amount < 0:
+                    raise ValueError("Cannot change balance")
+                user.balance += amount
+                transactions_type = (
+                    TransactionType.REPLENISHMENT
+                    if amount > 0
+                    else TransactionType.WITHDRAW
+                )
+                new_transaction = Transaction(
+                    username=username,
+                    amount=amount,
+                    transaction_type=transactions_type.value,
+                )
+                session.add(new_transaction)
+
+    @classmethod
+    async def add_prediction(
+        cls,
+        db_url: str,
+        task_id: str,
+        username: str,
+        prediction: str,
+        amount: float,
+        model_id: Optional[int] = None,
+    ) -> None:
+        user_manager = cls(db_url)
+        async with user_manager.session_scope() as session:
+            await session.execute(
+                build_prediction_upsert(),
+                {
+                    "task_id": task_id,
+                    "username": username,
+                    "prediction_result": prediction,
+                    "amount": amount,
+                },
+            )
+            await session.execute(
+                text("SELECT pg_notify(:channel, :payload)"),
+                {
+                    "channel": RESULT_NOTIFY_CHANNEL,
+                    "payload": build_notify_payload(task_id, model_id),
+                },
+            )
+
+    @classmethod
+    async def reserve_funds(cls, db_url: str, username: str, price: float) -> bool:
+        user_manager = cls(db_url)
+        async with user_manager.session_scope() as session:
+            result = await session.execute(
+                build_balance_change(username, -price, TransactionType.WITHDRAW.value)
+            )
+            return result.scalar() is not None
+
+    @classmethod
+    async def refund(
+        cls, db_url: str, username: str, amount: float, task_id: Optional[str] = None
+    ) -> None:
+        user_manager = cls(db_url)
+        async with user_manager.session_scope() as session:
+            await session.execute(build_refund(username, amount, task_id))
+
+    @classmethod
+    async def get_user_transactions(
+        cls, db_url: str, username: str, limit: int, cursor: Optional[str] = None
+    ) -> Tuple[List[dict], Optional[str]]:
+        user_manager = cls(db_url)
+        async with user_manager.session_scope() as session:
+            transactions = await session.scalars(
+                paginate(
+                    select(Transaction).where(Transaction.username == username),
+                    Transaction,
+                    limit,
+                    cursor,
+                )
+            )
+            transactions, next_cursor = split_page(transactions.all(), limit)
+            transactions = [transaction.to_dict() for transaction in transactions]
+        return transactions, next_cursor
+
+    @classmethod
+    async def get_user_predictions(
+        cls, db_url: str, username: str, limit: int, cursor: Optional[str] = None
+    ) -> Tuple[List[dict], Optional[str]]:
+        user_manager = cls(db_url)
+        async with user_manager.session_scope() as session:
+            predictions = await session.scalars(
+                paginate(
+                    select(Prediction).where(Prediction.username == username),
+                    Prediction,
+                    limit,
+                    cursor,
+                )
+            )
+            predictions, next_cursor = split_page(predictions.all(), limit)
+            predictions = [prediction.to_dict() for prediction in predictions]
+        return predictions, next_cursor
+
+    @classmethod
+    async def get_prediction_by_id(
+        cls, db_url: str, prediction_id: str, username: str
+    ):
+        user_manager = cls(db_url)
+        async with user_manager.session_scope() as session:
+            prediction_result = await session.scalar(
+                select(Prediction.prediction_result)
+                .where(
+                    (Prediction.task_id == prediction_id)
+                    & (Prediction.username == username)
+                )
+                .limit(1)
+            )
+            return prediction_result
@@ -1,15 +1,28 @@
 import json
 from contextlib import contextmanager
-from typing import Generator, Any
+from threading import Lock
+from typing import Generator, Any, Dict, List, Optional
 
-from sqlalchemy import create_engine, and_
+from sqlalchemy import create_engine, and_, text
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker, Session
 from dotenv import load_dotenv
 import os
 from datetime import datetime
 
 from .models import Base, User, Transaction, Prediction
+from .statements import (
+    build_prediction_upsert,
+    build_notify_payload,
+    build_refund,
+)
 from shemas.enums import TransactionType
+from config import (
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_POOL_RECYCLE,
+    RESULT_NOTIFY_CHANNEL,
+)
 
 load_dotenv()
 
@@ -18,13 +31,76 @@ POSTGRES_USER = os.getenv("POSTGRES_USER")
 POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD")
 
 
+# Движки и фабрики сессий кешируются на процесс по URL базы,
+# чтобы не пересоздавать пул соединений на каждый запрос.
+_engines: Dict[str, Engine] = {}
+_session_factories: Dict[str, sessionmaker] = {}
+_registry_lock = Lock()
+
+
+def get_engine(db_url: str) -> Engine:
+    engine = _engines.get(db_url)
+    if engine is None:
+        with _registry_lock:
+            engine = _engines.get(db_url)
+            if engine is None:
+                engine = create_engine(
+                    db_url,
+                    pool_size=DB_POOL_SIZE,
+                    max_overflow=DB_MAX_OVERFLOW,
+                    pool_recycle=DB_POOL_RECYCLE,
+                    pool_pre_ping=True,
+                )
+                _session_factories[db_url] = sessionmaker(
+                    autocommit=False, autoflush=False, bind=engine
+                )
+                _engines[db_url] = engine
+    return engine
+
+
+def get_session_factory(db_url: str) -> sessionmaker:
+    get_engine(db_url)
+    return _session_factories[db_url]
+
+
+# create_all не трогает уже существующие таблицы, поэтому колонки
+# и индексы, добавленные позже, докатываем сами
+SCHEMA_UPGRADES = [
+    "CREATE INDEX IF NOT EXISTS ix_transactions_username_date "
+    "ON transactions (username, date, id)",
+    "CREATE INDEX IF NOT EXISTS ix_predictions_username_date "
+    "ON predictions (username, date, id)",
+    "ALTER TABLE predictions ADD COLUMN IF NOT EXISTS max_new_tokens INTEGER",
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_predictions_task_id "
+    "ON predictions (task_id)",
+    # Уникальный индекс по task_id сделал составной лишним
+    "DROP INDEX IF EXISTS ix_predictions_task_id_username",
+    "ALTER TABLE transactions ADD COLUMN IF NOT EXISTS task_id VARCHAR",
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_transactions_task_id "
+    "ON transactions (task_id) WHERE task_id IS NOT NULL",
+]
+
+
+def init_schema(db_url: str) -> None:
+    engine = get_engine(db_url)
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        for statement in SCHEMA_UPGRADES:
+            connection.execute(text(statement))
+
+
+def dispose_engines() -> None:
+    with _registry_lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+        _session_factories.clear()
+
+
 class Database:
     def __init__(self, db_url: str):
-        self._engine = create_engine(db_url)
-        self._Session = sessionmaker(
-            autocommit=False, autoflush=False, bind=self._engine
-        )
-        Base.metadata.create_all(self._engine)
+        self._engine = get_engine(db_url)
+        self._Session = get_session_factory(db_url)
 
     @contextmanager
     def session_scope(self) -> Generator[Session, None, None]:
@@ -100,21 +176,86 @@ class UserManager(Database):
                 )
                 session.add(new_transaction)
 
+    @classmethod
+    def refund(
+        cls, db_url: str, username: str, amount: float, task_id: Optional[str] = None
+    ) -> None:
+        # С task_id возврат идемпотентен: повтор после неудачного ack'а
+        # денег второй раз не вернёт
+        user_manager = cls(db_url)
+        with user_manager.session_scope() as session:
+            session.execute(build_refund(username, amount, task_id))
+
     @classmethod
     def add_prediction(
-        cls, db_url: str, task_id: str, username: str, prediction: str, amount: float
+        cls,
+        db_url: str,
+        task_id: str,
+        username: str,
+        prediction: str,
+        amount: float,
+        max_new_tokens: Optional[int] = None,
     ) -> None:
         user_manager = cls(db_url)
         with user_manager.session_scope() as session:
             user = session.query(User).filter_by(username=username).first()
             if user:
-                users_prediction = Prediction(
-                    task_id=task_id,
-                    username=username,
-                    prediction_result=prediction,
-                    amount=amount,
+                session.execute(
+                    build_prediction_upsert(),
+                    {
+                        "task_id": task_id,
+                        "username": username,
+                        "prediction_result": prediction,
+                        "amount": amount,
+                        "max_new_tokens": max_new_tokens,
+                    },
+                )
+                # NOTIFY доставляется только после commit'а, так что API
+                # гарантированно увидит строку, когда проснётся
+                session.execute(
+                    text("SELECT pg_notify(:channel, :task_id)"),
+                    {"channel": RESULT_NOTIFY_CHANNEL, "task_id": task_id},
                 )
-                session.add(users_prediction)
+
+    @classmethod
+    def add_predictions(cls, db_url: str, predictions: List[Dict[str, Any]]) -> None:
+        # Пачка результатов воркера: один INSERT и одно уведомление
+        # на все task_id в той же транзакции. Существование пользователя
+        # проверяет внешний ключ, отдельный SELECT не нужен.
+        if not predictions:
+            return
+        # model_id - не столбец predictions, он нужен только уведомлению
+        payloads = [
+            build_notify_payload(row["task_id"], row.get("model_id"))
+            for row in predictions
+        ]
+        rows = [
+            {key: value for key, value in row.items() if key != "model_id"}
+            for row in predictions
+        ]
+        user_manager = cls(db_url)
+        with user_manager.session_scope() as session:
+            session.execute(build_prediction_upsert(), rows)
+            session.execute(
+                text(
+                    "SELECT pg_notify(:channel, payload) "
+                    "FROM unnest(CAST(:payloads AS text[])) AS payload"
+                ),
+                {"channel": RESULT_NOTIFY_CHANNEL, "payloads": payloads},
+            )
+
+    @classmethod
+    def get_completed_tasks(cls, db_url: str, task_ids: List[str]) -> Dict[str, str]:
+        # Уже посчитанные задачи из пачки: их результат возвращаем как есть,
+        # не запуская generate повторно
+        if not task_ids:
+            return {}
+        user_manager = cls(db_url)
+        with user_manager.session_scope() as session:
+            rows = session.query(
+                Prediction.task_id, Prediction.prediction_result
+            ).filter(Prediction.task_id.in_(task_ids))
+            return {task_id: result for task_id, result in rows}
 
     @classmethod
     def get_user_transactions(cls, db_url: str, username: str):
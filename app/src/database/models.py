@@ -2,7 +2,17 @@ import hashlib
 from datetime import datetime
 from typing import Any
 
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Float, DateTime
+from sqlalchemy import (
+    Column,
+    Integer,
+    String,
+    Boolean,
+    ForeignKey,
+    Float,
+    DateTime,
+    Index,
+    text,
+)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
@@ -57,6 +67,16 @@ class User(Base):
 
 class Transaction(Base):
     __tablename__ = "transactions"
+    __table_args__ = (
+        Index("ix_transactions_username_date", "username", "date", "id"),
+        # Возврат за задачу проводится не больше одного раза
+        Index(
+            "uq_transactions_task_id",
+            "task_id",
+            unique=True,
+            postgresql_where=text("task_id IS NOT NULL"),
+        ),
+    )
 
     id = Column(Integer, primary_key=True)
     username = Column(String, ForeignKey("users.username"), nullable=False)
@@ -65,6 +85,7 @@ class Transaction(Base):
         String, nullable=False
     )  # Например, 'replenishment' или 'withdraw'
     date = Column(DateTime, default=datetime.utcnow)
+    task_id = Column(String, nullable=True)  # Только у возвратов за задачу
 
     user = relationship("User", back_populates="transactions")
 
@@ -80,6 +101,11 @@ class Transaction(Base):
 
 class Prediction(Base):
     __tablename__ = "predictions"
+    __table_args__ = (
+        # Обслуживает и поиск по task_id вместе с username
+        Index("uq_predictions_task_id", "task_id", unique=True),
+        Index("ix_predictions_username_date", "username", "date", "id"),
+    )
 
     id = Column(Integer, primary_key=True)
     task_id = Column(String, nullable=False)
@@ -87,6 +113,7 @@ class Prediction(Base):
     prediction_result = Column(String, nullable=False)
     amount = Column(Float, nullable=False)
     date = Column(DateTime, default=datetime.utcnow)
+    max_new_tokens = Column(Integer, nullable=True)
 
     user = relationship("User", back_populates="predictions")
 
@@ -98,4 +125,5 @@ class Prediction(Base):
             "prediction_result": self.prediction_result,
             "amount": self.amount,
             "date": self.date.isoformat(),
+            "max_new_tokens": self.max_new_tokens,
         }
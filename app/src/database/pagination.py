@@ -0,0 +1,36 @@
+import base64
+from datetime import datetime
+from typing import Optional, Tuple
+
+from sqlalchemy import tuple_
+
+
+# Курсор - это (date, id) последней отданной строки. Страницы идут от
+# новых к старым, и условие (date, id) < курсора ложится на индекс
+# (username, date, id) без OFFSET'а.
+def encode_cursor(date: datetime, row_id: int) -> str:
+    raw = f"{date.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        date, row_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(date), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+
+
+def paginate(statement, model, limit: int, cursor: Optional[str] = None):
+    if cursor is not None:
+        date, row_id = decode_cursor(cursor)
+        statement = statement.where(tuple_(model.date, model.id) < tuple_(date, row_id))
+    return statement.order_by(model.date.desc(), model.id.desc()).limit(limit + 1)
+
+
+def split_page(rows: list, limit: int) -> Tuple[list, Optional[str]]:
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].date, rows[-1].id)
@@ -0,0 +1,79 @@
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import DateTime, String, insert, literal, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from .models import User, Transaction, Prediction
+from shemas.enums import TransactionType
+
+
+# Списание и зачисление одним запросом: UPDATE баланса в CTE и INSERT
+# транзакции из его RETURNING. Если условие на баланс не выполнилось,
+# CTE пуст и транзакция не пишется - RETURNING вернёт ноль строк.
+def build_balance_change(username: str, amount: float, transaction_type: str):
+    condition = User.username == username
+    if amount < 0:
+        condition = condition & (User.balance >= -amount)
+
+    changed = (
+        update(User)
+        .where(condition)
+        .values(balance=User.balance + amount)
+        .returning(User.username)
+        .cte("changed")
+    )
+    return insert(Transaction).from_select(
+        ["username", "amount", "transaction_type", "date"],
+        select(
+            changed.c.username,
+            literal(amount),
+            literal(transaction_type),
+            literal(datetime.utcnow(), DateTime),
+        ),
+    ).returning(Transaction.id)
+
+
+# Возврат за задачу: сначала INSERT транзакции с её task_id (повторный
+# возврат упрётся в уникальный индекс и ничего не вставит), а баланс
+# меняется только для вставленной строки. Без task_id конфликта не бывает.
+def build_refund(username: str, amount: float, task_id: Optional[str] = None):
+    refunded = (
+        pg_insert(Transaction)
+        .from_select(
+            ["username", "amount", "transaction_type", "date", "task_id"],
+            select(
+                literal(username),
+                literal(amount),
+                literal(TransactionType.REFUND.value),
+                literal(datetime.utcnow(), DateTime),
+                literal(task_id, String),
+            ),
+        )
+        .on_conflict_do_nothing(
+            index_elements=["task_id"], index_where=Transaction.task_id.isnot(None)
+        )
+        .returning(Transaction.id, Transaction.username)
+        .cte("refunded")
+    )
+    return (
+        update(User)
+        .where(User.username == refunded.c.username)
+        .values(balance=User.balance + amount)
+        .returning(refunded.c.id)
+    )
+
+
+# Повторная доставка задачи не должна плодить вторую строку результата:
+# task_id уникален, конфликт просто пропускается
+def build_prediction_upsert():
+    return pg_insert(Prediction).on_conflict_do_nothing(index_elements=["task_id"])
+
+
+# Задачи, посчитанные воркером, несут в уведомлении model_id: по нему API
+# оценивает пропускную способность очереди своей модели. Попадания в кеш
+# уведомляют только task_id и в пропускную способность не попадают.
+def build_notify_payload(task_id: str, model_id: Optional[int] = None) -> str:
+    if model_id is None:
+        return task_id
+    return f"{task_id}:{model_id}"
@@ -1,22 +1,61 @@
-import json
+import os
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
 import pika
+import torch
+from loguru import logger
 from config import get_connection_params
-from transformers import T5Tokenizer, T5ForConditionalGeneration
+from transformers import TextIteratorStreamer
 from functools import partial
 from threading import Thread
-from database.database import UserManager
-from database.models import Prediction
-from config import get_url
+from consumer import BatchConsumer
+from prompts import PromptEncoder, load_tokenizer
+from backends import load_backend
+from registry import (
+    DEFAULT_GENERATION,
+    MODELS,
+    ModelPool,
+    ModelSpec,
+    resolve_model_path,
+)
+from database.database import init_schema
+from config import (
+    get_url,
+    WORKER_MODELS,
+    MODEL_MEMORY_BUDGET_MB,
+    WORKER_BATCH_SIZE,
+    WORKER_BATCH_WAIT_MS,
+    MODEL_BACKEND,
+    GENERATION_MAX_TIME,
+    WORKER_READY_FILE,
+    CONSUMER_RECONNECT_DELAY,
+    CONSUMER_RECONNECT_MAX_DELAY,
+)
 
 
 class Model:
     def __init__(
-        self, model_id: int, model_name: str, tokenizer_path: str, model_path: str
+        self,
+        model_id: int,
+        model_name: str,
+        tokenizer_path: str,
+        model_path: str,
+        generation_kwargs: Optional[Dict[str, Any]] = None,
     ):
         self._model_id = model_id
         self._model_name = model_name
-        self.tokenizer = T5Tokenizer.from_pretrained(tokenizer_path)
-        self.model = T5ForConditionalGeneration.from_pretrained(model_path)
+        self._generation_kwargs = generation_kwargs or DEFAULT_GENERATION
+        self.tokenizer = load_tokenizer(resolve_model_path(tokenizer_path))
+        self.encoder = PromptEncoder(self.tokenizer)
+        self.backend = load_backend(MODEL_BACKEND, model_path, self.tokenizer)
+
+    @classmethod
+    def from_spec(cls, spec: ModelSpec, warm_up: bool = True) -> "Model":
+        model = cls(spec.model_id, spec.name, spec.path, spec.path, spec.generation)
+        if warm_up:
+            model.warm_up()
+        return model
 
     @property
     def get_model_id(self) -> int:
@@ -26,50 +65,147 @@ class Model:
     def get_model_name(self) -> str:
         return self._model_name
 
-    def predict(self, ch, method, properties, body):
-        # ИИ делает брр-брр
-        try:
-            data = json.loads(body)
-            prompt = data["prompt"]
-
-            adjusted_prompt = f"""
-                    If the prompt listed below does not contain information
-                    that you need to tell a joke or an anecdote,
-                    then tell them that you cannot process the request
-                    because you only know how to joke.
-                    
-                    Prompt: {prompt}
-                """
-
-            input_ids = self.tokenizer(adjusted_prompt, return_tensors="pt").input_ids
-            outputs = self.model.generate(
-                input_ids, max_length=200, do_sample=True, top_k=5, top_p=0.9
-            )
-
-            answer = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-            UserManager.add_prediction(
-                get_url(), data["id"], data["username"], answer, data["amount"]
-            )
-            channel.basic_ack(delivery_tag=method.delivery_tag)
-        except Exception as e:
-            print(e)
-
-
-model = Model(1, "Humorist", "google/flan-t5-base", "google/flan-t5-base")
-
-with pika.BlockingConnection(get_connection_params()) as connection:
-    with connection.channel() as channel:
+    def encode(self, prompt: str) -> List[int]:
+        return self.encoder.encode(prompt)
+
+    def predict_batch(self, prompts: List[str]) -> List[str]:
+        return self.generate_batch(self.encoder.encode_batch(prompts))
+
+    def generate_batch(self, input_ids: List[List[int]], **generation) -> List[str]:
+        # ИИ делает брр-брр, но сразу для нескольких уже токенизированных промптов
+        inputs = self.tokenizer.pad({"input_ids": input_ids}, return_tensors="pt")
+        outputs = self._generate(
+            input_ids=inputs.input_ids,
+            attention_mask=inputs.attention_mask,
+            **generation,
+        )
+        return self.tokenizer.batch_decode(outputs, skip_special_tokens=True)
+
+    def predict(self, prompt: str) -> str:
+        return self.predict_batch([prompt])[0]
+
+    def predict_stream(
+        self, prompt: str, input_ids: Optional[List[int]] = None, **generation
+    ) -> Iterator[str]:
+        # generate крутится в отдельном потоке, а мы отдаём текст
+        # по мере декодирования токенов
+        if input_ids is None:
+            input_ids = self.encode(prompt)
+        inputs = torch.tensor([input_ids])
+        # Пауза между кусочками не может быть дольше всего бюджета времени:
+        # если generate завис, итерация оборвётся queue.Empty
+        timeout = generation.get(
+            "max_time", self._generation_kwargs.get("max_time", GENERATION_MAX_TIME)
+        )
+        streamer = TextIteratorStreamer(
+            self.tokenizer, skip_prompt=True, skip_special_tokens=True, timeout=timeout
+        )
+        errors: List[Exception] = []
+
+        def generate() -> None:
+            # Упавший generate не закроет стример сам, и цикл ниже ждал бы
+            # вечно; ошибку пробрасываем в поток инференса
+            try:
+                self._generate(
+                    input_ids=inputs,
+                    attention_mask=torch.ones_like(inputs),
+                    streamer=streamer,
+                    **generation,
+                )
+            except Exception as e:
+                errors.append(e)
+            finally:
+                streamer.end()
+
+        thread = Thread(target=generate)
+        thread.start()
         try:
-            channel.queue_declare(queue="ml_task_queue", durable=True)
+            for chunk in streamer:
+                if chunk:
+                    yield chunk
+        finally:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    def warm_up(self) -> None:
+        # Первый generate прогревает аллокатор и ленивые инициализации,
+        # пусть это случится до того, как придёт живой пользователь
+        inputs = self.tokenizer(["Tell me a joke."], return_tensors="pt")
+        self._generate(
+            input_ids=inputs.input_ids,
+            attention_mask=inputs.attention_mask,
+            max_new_tokens=8,
+        )
+
+    def _generate(self, **kwargs):
+        with torch.inference_mode():
+            return self.backend.generate(**{**self._generation_kwargs, **kwargs})
+
 
-            channel.basic_qos(prefetch_count=1)
-            channel.basic_consume(
-                queue="ml_task_queue", on_message_callback=model.predict
-            )
-        except Exception as e:
-            print(e)
+def get_ready_file(slot: Optional[int] = None) -> str:
+    # У каждого процесса супервизора свой файл: переподключение одного
+    # не должно снимать готовность остальных
+    if slot is None:
+        return WORKER_READY_FILE
+    return f"{WORKER_READY_FILE}.{slot}"
 
+
+def mark_ready(path: str = WORKER_READY_FILE) -> None:
+    with open(path, "w") as ready_file:
+        ready_file.write(str(os.getpid()))
+
+
+def mark_not_ready(path: str = WORKER_READY_FILE) -> None:
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def get_worker_specs() -> List[ModelSpec]:
+    if not WORKER_MODELS:
+        return list(MODELS.values())
+    return [MODELS[int(model_id)] for model_id in WORKER_MODELS.split(",")]
+
+
+def run_consumer(models: ModelPool, ready_file: str = WORKER_READY_FILE) -> None:
+    # Потерянное соединение (брокер перезапустился, пропали heartbeat'ы)
+    # восстанавливаем с растущей паузой; неподтверждённые задачи брокер
+    # доставит заново
+    delay = CONSUMER_RECONNECT_DELAY
+    while True:
         try:
-            channel.start_consuming()
+            with pika.BlockingConnection(get_connection_params()) as connection:
+                with connection.channel() as channel:
+                    consumer = BatchConsumer(
+                        connection,
+                        channel,
+                        models,
+                        batch_size=WORKER_BATCH_SIZE,
+                        max_wait_ms=WORKER_BATCH_WAIT_MS,
+                    )
+                    delay = CONSUMER_RECONNECT_DELAY
+                    consumer.start(on_ready=partial(mark_ready, ready_file))
         except KeyboardInterrupt:
-            channel.stop_consuming()
+            return
+        except pika.exceptions.AMQPError as e:
+            mark_not_ready(ready_file)
+            logger.warning(f"RabbitMQ connection lost: {e!r}, retry in {delay} s")
+            time.sleep(delay)
+            delay = min(delay * 2, CONSUMER_RECONNECT_MAX_DELAY)
+
+
+def main():
+    init_schema(get_url())
+    specs = get_worker_specs()
+    models = ModelPool(specs, MODEL_MEMORY_BUDGET_MB, loader=Model.from_spec)
+    # Первую модель грузим сразу, остальные - по первому запросу
+    models.get(specs[0].model_id)
+
+    try:
+        run_consumer(models)
+    finally:
+        mark_not_ready()
+
+
+if __name__ == "__main__":
+    main()
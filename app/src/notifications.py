@@ -0,0 +1,103 @@
+import asyncio
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, Callable, Dict, List, Optional, Set
+
+import asyncpg
+from loguru import logger
+
+from config import get_dsn, RESULT_NOTIFY_CHANNEL
+
+
+# Слушает NOTIFY, который воркер отправляет в той же транзакции, где
+# сохраняет предсказание, и будит ожидающие этот task_id запросы.
+# Одно соединение с Postgres на процесс, вне пула SQLAlchemy.
+class ResultNotifier:
+    def __init__(self, dsn: str, channel: str):
+        self._dsn = dsn
+        self._channel = channel
+        self._connection: Optional[asyncpg.Connection] = None
+        self._waiters: Dict[str, Set[asyncio.Future]] = defaultdict(set)
+        self._reconnect_task: Optional[asyncio.Task] = None
+        self._stopped = False
+        self._completion_listeners: List[Callable[[int], None]] = []
+
+    def add_completion_listener(self, listener: Callable[[int], None]) -> None:
+        # Слушатель получает model_id каждой задачи, посчитанной воркером
+        self._completion_listeners.append(listener)
+
+    async def start(self) -> None:
+        self._stopped = False
+        self._connection = await asyncpg.connect(self._dsn)
+        self._connection.add_termination_listener(self._on_terminate)
+        await self._connection.add_listener(self._channel, self._on_notify)
+
+    async def stop(self) -> None:
+        self._stopped = True
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+            self._reconnect_task = None
+        if self._connection is not None and not self._connection.is_closed():
+            await self._connection.close()
+        self._connection = None
+        self._wake_all()
+
+    def _on_notify(self, connection, pid, channel, payload: str) -> None:
+        # Формат - build_notify_payload: "task_id" или "task_id:model_id"
+        task_id, _, model_id = payload.partition(":")
+        if model_id:
+            for listener in self._completion_listeners:
+                listener(int(model_id))
+        for future in self._waiters.pop(task_id, ()):
+            if not future.done():
+                future.set_result(None)
+
+    def _on_terminate(self, connection) -> None:
+        # Уведомления, пришедшие во время обрыва, потеряны: пусть все
+        # ожидающие перепроверят базу, а мы тем временем переподключимся.
+        self._wake_all()
+        if not self._stopped and self._reconnect_task is None:
+            self._reconnect_task = asyncio.ensure_future(self._reconnect())
+
+    async def _reconnect(self) -> None:
+        delay = 1
+        try:
+            while not self._stopped:
+                try:
+                    await self.start()
+                    return
+                except (OSError, asyncpg.PostgresError) as e:
+                    logger.warning(f"Result notifier reconnect failed: {e}")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, 30)
+        finally:
+            self._reconnect_task = None
+
+    def _wake_all(self) -> None:
+        waiters, self._waiters = self._waiters, defaultdict(set)
+        for futures in waiters.values():
+            for future in futures:
+                if not future.done():
+                    future.set_result(None)
+
+    @asynccontextmanager
+    async def subscribe(self, task_id: str) -> AsyncGenerator[asyncio.Future, None]:
+        # Подписываться надо до проверки базы, иначе NOTIFY может проскочить
+        # между SELECT'ом и началом ожидания.
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[task_id].add(future)
+        try:
+            yield future
+        finally:
+            futures = self._waiters.get(task_id)
+            if futures is not None:
+                futures.discard(future)
+                if not futures:
+                    del self._waiters[task_id]
+
+
+notifier = ResultNotifier(get_dsn(), RESULT_NOTIFY_CHANNEL)
+
+
+def get_notifier() -> ResultNotifier:
+    return notifier
@@ -0,0 +1,68 @@
+import copy
+import math
+from typing import List
+
+import torch
+from loguru import logger
+
+PRECISIONS = ("fp32", "int8", "bf16")
+
+PROBE_PROMPTS = [
+    "Tell me a joke about cats.",
+    "Tell me an anecdote about programmers.",
+    "What is the capital of France?",
+]
+
+
+def supports_bf16() -> bool:
+    # Без AVX512-BF16/AMX bf16 на CPU эмулируется и работает медленнее fp32
+    is_supported = getattr(torch.cpu, "_is_avx512_bf16_supported", None)
+    return bool(is_supported is not None and is_supported())
+
+
+def convert(model, precision: str):
+    if precision == "int8":
+        # Динамическая квантизация: веса Linear хранятся в int8,
+        # активации квантуются на лету
+        return torch.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+    if precision == "bf16":
+        return copy.deepcopy(model).to(torch.bfloat16)
+    return model
+
+
+def perplexity_ratio(reference, candidate, tokenizer, prompts: List[str]) -> float:
+    # Во сколько раз candidate хуже reference предсказывает жадные
+    # ответы самой reference-модели на контрольные промпты
+    inputs = tokenizer(prompts, return_tensors="pt", padding=True)
+    with torch.inference_mode():
+        outputs = reference.generate(**inputs, max_new_tokens=32, do_sample=False)
+        labels = outputs[:, 1:].masked_fill(
+            outputs[:, 1:] == tokenizer.pad_token_id, -100
+        )
+        reference_loss = reference(**inputs, labels=labels).loss.float()
+        candidate_loss = candidate(**inputs, labels=labels).loss.float()
+    return math.exp((candidate_loss - reference_loss).item())
+
+
+def prepare_model(model, tokenizer, precision: str, check: bool, tolerance: float):
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown model precision: {precision}")
+    if precision == "fp32":
+        return model
+    if precision == "bf16" and not supports_bf16():
+        logger.warning("CPU has no native bf16 support, staying on fp32")
+        return model
+
+    candidate = convert(model, precision)
+    if check:
+        ratio = perplexity_ratio(model, candidate, tokenizer, PROBE_PROMPTS)
+        if ratio > 1 + tolerance:
+            logger.warning(
+                f"{precision} perplexity is {ratio:.3f}x of fp32 "
+                f"(tolerance {tolerance}), staying on fp32"
+            )
+            return model
+        logger.info(f"{precision} self-check passed: perplexity {ratio:.3f}x of fp32")
+    return candidate
@@ -0,0 +1,51 @@
+import argparse
+
+from transformers import AutoTokenizer, T5ForConditionalGeneration
+
+from backends import get_onnx_dir
+from registry import get_local_dir
+
+
+def download(model_path: str) -> None:
+    local_dir = get_local_dir(model_path)
+    model = T5ForConditionalGeneration.from_pretrained(model_path)
+    model.save_pretrained(local_dir, safe_serialization=True)
+    AutoTokenizer.from_pretrained(model_path).save_pretrained(local_dir)
+    print(f"{model_path} saved to {local_dir}")
+
+
+def export_onnx(model_path: str) -> None:
+    from optimum.onnxruntime import ORTModelForSeq2SeqLM
+
+    onnx_dir = get_onnx_dir(model_path)
+    model = ORTModelForSeq2SeqLM.from_pretrained(
+        model_path, export=True, use_cache=True
+    )
+    model.save_pretrained(onnx_dir)
+    AutoTokenizer.from_pretrained(model_path).save_pretrained(onnx_dir)
+    print(f"ONNX export of {model_path} saved to {onnx_dir}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Подготовка артефактов модели")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    download_parser = commands.add_parser(
+        "download", help="сохранить веса локально в формате safetensors"
+    )
+    download_parser.add_argument("--model", default="google/flan-t5-base")
+
+    export_parser = commands.add_parser(
+        "export-onnx", help="экспортировать энкодер и декодер в ONNX"
+    )
+    export_parser.add_argument("--model", default="google/flan-t5-base")
+
+    args = parser.parse_args()
+    if args.command == "download":
+        download(args.model)
+    elif args.command == "export-onnx":
+        export_onnx(args.model)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import os
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+from registry import ModelSpec, get_local_dir
+
+PROMPT_TEMPLATE = """
+                    If the prompt listed below does not contain information
+                    that you need to tell a joke or an anecdote,
+                    then tell them that you cannot process the request
+                    because you only know how to joke.
+                    
+                    Prompt: {prompt}
+                """
+
+
+def load_tokenizer(path: str):
+    from transformers import AutoTokenizer
+
+    return AutoTokenizer.from_pretrained(path, use_fast=True)
+
+
+# Шаблон одинаков для всех промптов, поэтому его части токенизируются
+# один раз, а на каждый запрос кодируется только сам промпт
+class PromptEncoder:
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        prefix, suffix = PROMPT_TEMPLATE.split("{prompt}")
+        self._prefix_ids = self._tokenize(prefix)
+        self._suffix_ids = self._tokenize(suffix)
+        eos = tokenizer.eos_token_id
+        self._eos_ids = [] if eos is None else [eos]
+
+    def _tokenize(self, text: str) -> List[int]:
+        return self.tokenizer(text, add_special_tokens=False).input_ids
+
+    def encode(self, prompt: str) -> List[int]:
+        return self._wrap(self._tokenize(prompt))
+
+    def _wrap(self, prompt_ids: List[int]) -> List[int]:
+        return self._prefix_ids + prompt_ids + self._suffix_ids + self._eos_ids
+
+    def encode_batch(self, prompts: List[str]) -> List[List[int]]:
+        encoded = self.tokenizer(prompts, add_special_tokens=False).input_ids
+        return [self._wrap(ids) for ids in encoded]
+
+
+_encoders: Dict[int, Optional[PromptEncoder]] = {}
+
+
+# Энкодер для API: только из локальной копии модели, без похода в хаб.
+# Если копии нет, задача уходит без токенов и их посчитает воркер.
+def get_encoder(spec: ModelSpec) -> Optional[PromptEncoder]:
+    if spec.model_id not in _encoders:
+        local_dir = get_local_dir(spec.path)
+        encoder = None
+        if os.path.isdir(local_dir):
+            try:
+                encoder = PromptEncoder(load_tokenizer(local_dir))
+            except Exception as e:
+                logger.warning(f"Cannot load tokenizer from {local_dir}: {e}")
+        _encoders[spec.model_id] = encoder
+    return _encoders[spec.model_id]
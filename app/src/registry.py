@@ -0,0 +1,147 @@
+import json
+import os
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List
+
+from loguru import logger
+
+from config import (
+    MODEL_CACHE_DIR,
+    PROMPT_PRICE,
+    TASK_QUEUE,
+    MODEL_REGISTRY_FILE,
+    DEFAULT_MODEL_ID,
+)
+
+
+@dataclass(frozen=True)
+class ModelSpec:
+    model_id: int
+    name: str
+    path: str
+    price: float
+    queue: str
+    memory_mb: int
+    generation: Dict[str, Any] = field(default_factory=dict)
+
+
+DEFAULT_GENERATION = {
+    "max_new_tokens": 200,
+    "do_sample": True,
+    "top_k": 5,
+    "top_p": 0.9,
+}
+
+DEFAULT_MODELS = [
+    ModelSpec(
+        model_id=1,
+        name="Humorist",
+        path="google/flan-t5-base",
+        price=PROMPT_PRICE,
+        queue=TASK_QUEUE,
+        memory_mb=1000,
+        generation=DEFAULT_GENERATION,
+    ),
+    ModelSpec(
+        model_id=2,
+        name="Quick Humorist",
+        path="google/flan-t5-small",
+        price=PROMPT_PRICE / 2,
+        queue=f"{TASK_QUEUE}.small",
+        memory_mb=350,
+        generation=DEFAULT_GENERATION,
+    ),
+]
+
+
+def load_registry(path: str = MODEL_REGISTRY_FILE) -> Dict[int, ModelSpec]:
+    # Файл реестра - JSON-список с полями ModelSpec; без него
+    # используются две модели по умолчанию
+    if not path:
+        specs = DEFAULT_MODELS
+    else:
+        with open(path) as registry_file:
+            specs = [ModelSpec(**spec) for spec in json.load(registry_file)]
+    return {spec.model_id: spec for spec in specs}
+
+
+MODELS = load_registry()
+
+
+def get_spec(model_id: int = DEFAULT_MODEL_ID) -> ModelSpec:
+    return MODELS[model_id]
+
+
+def get_local_dir(model_path: str) -> str:
+    return os.path.join(MODEL_CACHE_DIR, model_path.replace("/", "--"))
+
+
+def resolve_model_path(model_path: str) -> str:
+    local_dir = get_local_dir(model_path)
+    if os.path.isdir(local_dir):
+        return local_dir
+    logger.warning(
+        f"No local copy of {model_path} in {local_dir}, loading from the hub; "
+        f"run: python src/prepare_model.py download --model {model_path}"
+    )
+    return model_path
+
+
+# Модели воркера, загружаемые по первому запросу. Если суммарный
+# memory_mb превышает бюджет, выгружается та, что дольше всех простаивала.
+class ModelPool:
+    def __init__(
+        self,
+        specs: Iterable[ModelSpec],
+        memory_budget_mb: int,
+        loader: Callable[[ModelSpec], Any],
+    ):
+        self._specs = {spec.model_id: spec for spec in specs}
+        self._memory_budget_mb = memory_budget_mb
+        self._loader = loader
+        self._loaded: "OrderedDict[int, Any]" = OrderedDict()
+
+    @property
+    def specs(self) -> List[ModelSpec]:
+        return list(self._specs.values())
+
+    @property
+    def loaded_ids(self) -> List[int]:
+        return list(self._loaded)
+
+    @property
+    def loaded_models(self) -> List[Any]:
+        return list(self._loaded.values())
+
+    def preload(self) -> None:
+        # Грузим модели по порядку, пока они помещаются в бюджет целиком
+        used = 0
+        for spec in self._specs.values():
+            if used + spec.memory_mb > self._memory_budget_mb:
+                break
+            self.get(spec.model_id)
+            used += spec.memory_mb
+
+    def get(self, model_id: int):
+        if model_id not in self._specs:
+            raise KeyError(f"Model {model_id} is not served by this worker")
+
+        model = self._loaded.get(model_id)
+        if model is not None:
+            self._loaded.move_to_end(model_id)
+            return model
+
+        spec = self._specs[model_id]
+        self._make_room(spec.memory_mb)
+        logger.info(f"Loading model {spec.model_id} ({spec.path})")
+        model = self._loader(spec)
+        self._loaded[model_id] = model
+        return model
+
+    def _make_room(self, memory_mb: int) -> None:
+        used = sum(self._specs[model_id].memory_mb for model_id in self._loaded)
+        while self._loaded and used + memory_mb > self._memory_budget_mb:
+            evicted_id, _ = self._loaded.popitem(last=False)
+            used -= self._specs[evicted_id].memory_mb
+            logger.info(f"Evicting model {evicted_id} to fit the memory budget")
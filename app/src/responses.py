@@ -0,0 +1,19 @@
+from typing import AsyncIterator, List
+
+import orjson
+
+
+# Отдаём JSON-массив кусками по мере чтения строк из серверного курсора,
+# так что память не зависит от размера выборки.
+async def stream_json_array(
+    partitions: AsyncIterator[List[dict]],
+) -> AsyncIterator[bytes]:
+    yield b"["
+    first = True
+    async for rows in partitions:
+        if not rows:
+            continue
+        chunk = b",".join(orjson.dumps(row) for row in rows)
+        yield chunk if first else b"," + chunk
+        first = False
+    yield b"]"
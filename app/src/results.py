@@ -0,0 +1,167 @@
+import json
+import queue
+import time
+from functools import partial
+from threading import Thread
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+from loguru import logger
+
+from database.database import UserManager
+from config import get_url, DEFAULT_MODEL_ID
+
+
+# delivery_tag в канале растут монотонно, поэтому ack с multiple=True
+# можно слать только до первой ещё не обработанной задачи: всё, что ниже,
+# уже либо сохранено, либо отклонено поштучно.
+class AckTracker:
+    def __init__(self):
+        self._pending: Dict[int, Any] = {}
+        self._done: Set[int] = set()
+
+    def track(self, delivery_tag: int, delivery: Any = None) -> None:
+        self._pending[delivery_tag] = delivery
+
+    def delivery(self, delivery_tag: int) -> Any:
+        # Единственное, что можно звать не из потока pika: запись
+        # появляется до того, как задача уйдёт в батч, и удаляется
+        # только после её подтверждения
+        return self._pending.get(delivery_tag)
+
+    def settle(self, delivery_tag: int) -> None:
+        self._pending.pop(delivery_tag, None)
+
+    def complete(self, delivery_tags: Iterable[int]) -> Optional[int]:
+        for delivery_tag in delivery_tags:
+            self._pending.pop(delivery_tag, None)
+            self._done.add(delivery_tag)
+        floor = min(self._pending, default=None)
+        ready = [tag for tag in self._done if floor is None or tag < floor]
+        if not ready:
+            return None
+        self._done.difference_update(ready)
+        return max(ready)
+
+
+# Копит готовые результаты и пишет их в базу пачками в отдельном потоке,
+# чтобы generate не ждал commit'а. Ack'и (и финальные события стримов)
+# возвращаются в поток pika через add_callback_threadsafe только после
+# успешного commit'а. Если пачка не записалась, строки пишутся по одной,
+# а те, что не записались и так, отдаются on_failure (повтор задачи или
+# очередь мёртвых писем) - одна плохая строка не держит всю пачку.
+class ResultWriter:
+    def __init__(
+        self,
+        connection,
+        channel,
+        tracker: AckTracker,
+        flush_size: int,
+        flush_interval_ms: int,
+        on_failure: Callable[[int, dict], None],
+    ):
+        self._connection = connection
+        self._channel = channel
+        self._tracker = tracker
+        self._on_failure = on_failure
+        self._flush_size = max(1, flush_size)
+        self._flush_interval = max(0, flush_interval_ms) / 1000
+        self._results: queue.Queue = queue.Queue()
+        self._thread = Thread(target=self._run, name="result-writer", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        # Дописывает то, что уже накоплено, и завершает поток
+        self._results.put(None)
+        self._thread.join()
+
+    def submit(
+        self,
+        delivery_tag: int,
+        task: dict,
+        answer: str,
+        max_new_tokens: Optional[int] = None,
+    ) -> None:
+        self._results.put((delivery_tag, task, answer, max_new_tokens))
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            results = self._drain()
+            stopping = None in results
+            results = [result for result in results if result is not None]
+            if results:
+                self._flush(results)
+
+    def _drain(self) -> List[Optional[tuple]]:
+        results = [self._results.get()]
+        deadline = time.monotonic() + self._flush_interval
+        while len(results) < self._flush_size and results[-1] is not None:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    results.append(self._results.get(timeout=remaining))
+                else:
+                    results.append(self._results.get_nowait())
+            except queue.Empty:
+                break
+        return results
+
+    def _flush(self, results: List[tuple]) -> None:
+        rows = [
+            {
+                "task_id": task["id"],
+                "username": task["username"],
+                "prediction_result": answer,
+                "amount": task["amount"],
+                "max_new_tokens": max_new_tokens,
+                "model_id": task.get("model_id", DEFAULT_MODEL_ID),
+            }
+            for _, task, answer, max_new_tokens in results
+        ]
+        try:
+            UserManager.add_predictions(get_url(), rows)
+        except Exception as e:
+            logger.exception(e)
+            results = self._flush_each(results, rows)
+        if not results:
+            return
+        try:
+            self._connection.add_callback_threadsafe(
+                partial(self.acknowledge, results)
+            )
+        except Exception as e:
+            # Соединение уже закрыто: результаты сохранены, а задачи
+            # брокер доставит заново и воркер подтвердит их без generate
+            logger.warning(f"Cannot acknowledge {len(results)} results: {e!r}")
+
+    def _flush_each(self, results: List[tuple], rows: List[dict]) -> List[tuple]:
+        saved = []
+        for result, row in zip(results, rows):
+            try:
+                UserManager.add_predictions(get_url(), [row])
+            except Exception as e:
+                logger.exception(e)
+                delivery_tag, task, *_ = result
+                self._on_failure(delivery_tag, task)
+            else:
+                saved.append(result)
+        return saved
+
+    # Вызывается только из потока pika
+    def acknowledge(self, results: List[tuple]) -> None:
+        # Финальное событие уходит после сохранения, чтобы клиент
+        # сразу мог найти результат и через обычный эндпоинт
+        for _, task, answer, _ in results:
+            if "stream_queue" in task:
+                self._channel.basic_publish(
+                    exchange="",
+                    routing_key=task["stream_queue"],
+                    body=json.dumps({"done": True, "prediction": answer}),
+                )
+        watermark = self._tracker.complete(
+            delivery_tag for delivery_tag, *_ in results
+        )
+        if watermark is not None:
+            self._channel.basic_ack(delivery_tag=watermark, multiple=True)
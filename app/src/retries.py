@@ -0,0 +1,43 @@
+from typing import Any, Dict
+
+from config import TASK_MAX_ATTEMPTS, TASK_RETRY_BASE_DELAY_MS, DEAD_LETTER_SUFFIX
+
+RETRY_COUNT_HEADER = "x-retry-count"
+
+
+def get_dead_letter_queue(queue: str) -> str:
+    return f"{queue}{DEAD_LETTER_SUFFIX}"
+
+
+def get_retry_queue(queue: str, delay_ms: int) -> str:
+    # Задержка в имени: очередь с другим x-message-ttl объявить под тем же
+    # именем нельзя, а так смена настроек просто заводит новые очереди
+    return f"{queue}.retry.{delay_ms}"
+
+
+# Упавшая задача ждёт в очереди задержки (своей на каждую попытку) без
+# консьюмеров: по истечении x-message-ttl брокер возвращает её в рабочую
+# очередь. После max_attempts попыток задача уходит в очередь мёртвых писем.
+class RetryPolicy:
+    def __init__(self, max_attempts: int, base_delay_ms: int):
+        self.max_attempts = max(1, max_attempts)
+        self._base_delay_ms = base_delay_ms
+
+    def should_retry(self, attempt: int) -> bool:
+        return attempt < self.max_attempts
+
+    def delay_ms(self, attempt: int) -> int:
+        return self._base_delay_ms * 2 ** (attempt - 1)
+
+    def retry_queue(self, queue: str, attempt: int) -> str:
+        return get_retry_queue(queue, self.delay_ms(attempt))
+
+    def retry_queue_arguments(self, queue: str, attempt: int) -> Dict[str, Any]:
+        return {
+            "x-message-ttl": self.delay_ms(attempt),
+            "x-dead-letter-exchange": "",
+            "x-dead-letter-routing-key": queue,
+        }
+
+
+retry_policy = RetryPolicy(TASK_MAX_ATTEMPTS, TASK_RETRY_BASE_DELAY_MS)
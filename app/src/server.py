@@ -1,18 +1,86 @@
+import asyncio
 import json
 import uuid
 from datetime import datetime, timezone
+from typing import Optional
+
+from loguru import logger
+from fastapi import FastAPI, HTTPException, Depends, Response, Request, Query
+from fastapi.responses import StreamingResponse, ORJSONResponse
+from auth import create_access_token, Principal, token_cache
+
+from broker import (
+    TaskPublisher,
+    StreamNotFound,
+    get_publisher,
+    get_stream_queue_name,
+    publisher,
+)
+from admission import AdmissionController, QueueOverloaded, admission, get_admission
+from budget import generation_policy
+from cache import PromptCache, prompt_cache
+from prompts import get_encoder
+from registry import MODELS, get_spec
+from retries import get_dead_letter_queue
+from responses import stream_json_array
+from notifications import ResultNotifier, get_notifier, notifier
+from database.database import UserManager, init_schema, dispose_engines
+from database.async_database import AsyncUserManager, dispose_async_engines
+from shemas.shemas import UserData, Transaction, PredictionCreate, AnecdoteRequest
+from shemas.enums import TaskLane, LANE_PRIORITIES
+
+from config import (
+    get_url,
+    get_async_url,
+    SECRET_KEY,
+    ALGORITHM,
+    LONG_POLL_MAX_TIMEOUT,
+    STREAM_IDLE_TIMEOUT,
+    PROMPT_CACHE_ENABLED,
+    EXPRESS_SURCHARGE,
+    INGRESS_TOKENIZE,
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+)
+from jose import jwt, JWTError, ExpiredSignatureError
 
-from fastapi import FastAPI, HTTPException, Depends, Response, Request
-from auth import create_access_token
+app = FastAPI()
 
-from database.database import UserManager
-from shemas.shemas import UserData, Transaction, PredictionCreate, AnecdoteRequest
 
-from config import get_url, SECRET_KEY, ALGORITHM, PROMPT_PRICE, get_connection_params
-from jose import jwt, JWTError
-import pika
+def record_completion(model_id: int) -> None:
+    spec = MODELS.get(model_id)
+    if spec is not None:
+        admission.record_completion(spec.queue)
+
+
+@app.on_event("startup")
+async def on_startup():
+    init_schema(get_url())
+    try:
+        await publisher.connect()
+    except Exception as e:
+        # Брокер может подняться позже API: publish и /ready подключатся
+        # сами при первом обращении, а до тех пор отвечают 503
+        logger.warning(f"RabbitMQ is not available yet: {e!r}")
+    notifier.add_completion_listener(record_completion)
+    await notifier.start()
+    if INGRESS_TOKENIZE:
+        # Токенизаторы грузятся с диска, не держим ими event loop
+        loop = asyncio.get_running_loop()
+        for spec in MODELS.values():
+            await loop.run_in_executor(None, get_encoder, spec)
 
-app = FastAPI()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await notifier.stop()
+    await publisher.close()
+    dispose_engines()
+    await dispose_async_engines()
+
+
+def get_prompt_cache() -> PromptCache:
+    return prompt_cache
 
 
 def get_token(request: Request):
@@ -22,33 +90,38 @@ def get_token(request: Request):
     return token
 
 
-def authenticate(request: Request):
+async def authenticate(request: Request) -> Principal:
     token = get_token(request)
+    principal = token_cache.get(token)
+    if principal is not None:
+        return principal
+
     try:
         payload = jwt.decode(token, key=SECRET_KEY, algorithms=[ALGORITHM])
+    except ExpiredSignatureError:
+        raise HTTPException(status_code=401, detail="Token has expired")
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-    expire = payload["exp"]
-    expire_time = datetime.fromtimestamp(int(expire), tz=timezone.utc)
-    if (not expire) or (expire_time < datetime.now(timezone.utc)):
+    expire = payload.get("exp")
+    if not expire:
         raise HTTPException(status_code=401, detail="Token has expired")
 
-    user_id = payload["sub"]
+    user_id = payload.get("sub")
     if not user_id:
         raise HTTPException(status_code=401, detail="User not found")
 
-    return token
-
-
-def is_admin(token: str):
-    payload = jwt.decode(token, key=SECRET_KEY, algorithms=[ALGORITHM])
-    return payload["is_admin"]
-
+    principal = Principal(
+        user_id=int(user_id),
+        username=payload["username"],
+        is_admin=bool(payload.get("is_admin")),
+        expires_at=datetime.fromtimestamp(int(expire), tz=timezone.utc),
+    )
+    if principal.is_expired:
+        raise HTTPException(status_code=401, detail="Token has expired")
 
-def get_username_from_token(token: str):
-    payload = jwt.decode(token, key=SECRET_KEY, algorithms=[ALGORITHM])
-    return payload["username"]
+    token_cache.put(token, principal)
+    return principal
 
 
 @app.post("/register")
@@ -75,18 +148,18 @@ def login(response: Response, user_data: UserData):
     )
     response.set_cookie("access_token", access_token, httponly=True)
 
-    return {"access_token": access_token, "refresh_token": None}
+    return {"access_token": access_token, "refresh_token": None, "is_admin": is_admin}
 
 
 @app.post("/deposit")
-def deposit(transaction: Transaction, token: str = Depends(authenticate)):
+def deposit(transaction: Transaction, principal: Principal = Depends(authenticate)):
     if transaction.amount == 0:
         raise HTTPException(
             status_code=400, detail="You cannot conduct zero-sum transactions."
         )
     try:
         UserManager.change_balance(
-            get_url(), get_username_from_token(token), transaction.amount
+            get_url(), principal.username, transaction.amount
         )
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -94,69 +167,265 @@ def deposit(transaction: Transaction, token: str = Depends(authenticate)):
 
 
 @app.get("/balance")
-def get_balance(token: str = Depends(authenticate)):
-    user_balance = UserManager.get_balance(get_url(), get_username_from_token(token))
+async def get_balance(principal: Principal = Depends(authenticate)):
+    user_balance = await AsyncUserManager.get_balance(
+        get_async_url(), principal.username
+    )
     return user_balance
 
 
 @app.get("/predictions")
-def get_predictions(token: str = Depends(authenticate)):
-    predictions = UserManager.get_user_predictions(
-        get_url(), get_username_from_token(token)
-    )
-    return predictions
+async def get_predictions(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    principal: Principal = Depends(authenticate),
+):
+    try:
+        predictions, next_cursor = await AsyncUserManager.get_user_predictions(
+            get_async_url(), principal.username, limit, cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return ORJSONResponse(predictions, headers=headers)
 
 
 @app.get("/all_users")
-def get_all_users(token: str = Depends(authenticate)):
-    if not is_admin(token):
+async def get_all_users(principal: Principal = Depends(authenticate)):
+    if not principal.is_admin:
         raise HTTPException(status_code=400, detail="User not admin")
 
-    return UserManager.get_all_users(get_url())
+    return StreamingResponse(
+        stream_json_array(AsyncUserManager.iter_all_users(get_async_url())),
+        media_type="application/json",
+    )
 
 
 @app.get("/all_transactions")
-def get_user_transactions(token: str = Depends(authenticate)):
-    username = get_username_from_token(token)
-    transactions = UserManager.get_user_transactions(get_url(), username)
-    return transactions
+async def get_user_transactions(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    principal: Principal = Depends(authenticate),
+):
+    username = principal.username
+    try:
+        transactions, next_cursor = await AsyncUserManager.get_user_transactions(
+            get_async_url(), username, limit, cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return ORJSONResponse(transactions, headers=headers)
 
 
 @app.post("/anecdote")
-def get_anecdote(prompt_data: AnecdoteRequest, token: str = Depends(authenticate)):
-    username = get_username_from_token(token)
+async def get_anecdote(
+    prompt_data: AnecdoteRequest,
+    principal: Principal = Depends(authenticate),
+    publisher: TaskPublisher = Depends(get_publisher),
+    cache: PromptCache = Depends(get_prompt_cache),
+    admission: AdmissionController = Depends(get_admission),
+):
+    username = principal.username
+    try:
+        spec = get_spec(prompt_data.model_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Model not found")
+
+    use_cache = PROMPT_CACHE_ENABLED and not prompt_data.stream
+    cached = cache.get(prompt_data.prompt, spec.model_id) if use_cache else None
+
+    # Доплата за срочность - за место в очереди, попадание в кеш её не платит
+    price = spec.price
+    if cached is None and prompt_data.lane == TaskLane.EXPRESS:
+        price += EXPRESS_SURCHARGE
+
+    # Не берём денег за задачу, которая всё равно дождётся результата
+    # слишком поздно. Попадание в кеш очередь не нагружает.
+    eta = None
+    if cached is None:
+        try:
+            eta = await admission.admit(publisher, spec.queue)
+        except QueueOverloaded as e:
+            raise HTTPException(
+                status_code=429,
+                detail="Too many tasks in the queue, try again later",
+                headers={"Retry-After": str(e.retry_after)},
+            )
+        except Exception:
+            raise HTTPException(status_code=503, detail="Task queue unavailable")
 
-    if UserManager.get_balance(get_url(), username) < PROMPT_PRICE:
+    # Деньги резервируются одним условным UPDATE'ом ещё до публикации;
+    # если задача не дойдёт до модели, воркер (или мы сами) их вернёт
+    if not await AsyncUserManager.reserve_funds(get_async_url(), username, price):
         raise HTTPException(status_code=400, detail="Insufficient funds")
 
-    with pika.BlockingConnection(get_connection_params()) as connection:
-        with connection.channel() as channel:
-            channel.queue_declare(queue="ml_task_queue", durable=True)
-
-            task_id = str(uuid.uuid4())
-            task = {
-                "id": task_id,
-                "prompt": prompt_data.prompt,
-                "username": username,
-                "amount": -PROMPT_PRICE,
-            }
-
-            channel.basic_publish(
-                exchange="",
-                routing_key="ml_task_queue",
-                body=json.dumps(task),
-                properties=pika.BasicProperties(delivery_mode=2),
+    task_id = str(uuid.uuid4())
+    if cached is not None:
+        # Попадание в кеш обслуживаем без очереди и модели
+        try:
+            await AsyncUserManager.add_prediction(
+                get_async_url(), task_id, username, cached, -price
+            )
+        except Exception:
+            await AsyncUserManager.refund(get_async_url(), username, price, task_id)
+            raise HTTPException(
+                status_code=503, detail="Prediction storage unavailable"
             )
+        return {"task_id": task_id, "cached": True, "eta_seconds": 0}
+
+    task = {
+        "id": task_id,
+        "prompt": prompt_data.prompt,
+        "username": username,
+        "amount": -price,
+        "model_id": spec.model_id,
+        **generation_policy.for_request(
+            prompt_data.max_new_tokens, prompt_data.latency_budget_ms
+        ),
+    }
+    encoder = get_encoder(spec) if INGRESS_TOKENIZE else None
+    if encoder is not None:
+        # Воркеру не придётся токенизировать, а по длине он соберёт батчи
+        task["input_ids"] = encoder.encode(prompt_data.prompt)
+        task["n_tokens"] = len(task["input_ids"])
+    try:
+        if prompt_data.stream:
+            task["stream_queue"] = get_stream_queue_name(username, task_id)
+            await publisher.declare_stream(task["stream_queue"])
+        await publisher.publish(
+            task, spec.queue, priority=LANE_PRIORITIES[prompt_data.lane]
+        )
+    except Exception:
+        await AsyncUserManager.refund(get_async_url(), username, price, task_id)
+        raise HTTPException(status_code=503, detail="Task queue unavailable")
 
-            UserManager.change_balance(get_url(), username, -PROMPT_PRICE)
+    if use_cache:
+        cache.track(task_id, prompt_data.prompt, spec.model_id)
 
-    return {"task_id": task_id}
+    return {"task_id": task_id, "eta_seconds": eta}
 
 
 @app.get("/anecdote/{task_id}")
-def get_anecdote_result(task_id: str, token: str = Depends(authenticate)):
-    username = get_username_from_token(token)
-    predictions = UserManager.get_prediction_by_id(get_url(), task_id, username)
+async def get_anecdote_result(
+    task_id: str,
+    principal: Principal = Depends(authenticate),
+    cache: PromptCache = Depends(get_prompt_cache),
+):
+    username = principal.username
+    predictions = await AsyncUserManager.get_prediction_by_id(
+        get_async_url(), task_id, username
+    )
     if predictions is None:
         raise HTTPException(status_code=400, detail="Task result not found")
+    cache.resolve(task_id, predictions)
     return {"prediction": predictions}
+
+
+@app.get("/anecdote/{task_id}/wait")
+async def wait_anecdote_result(
+    task_id: str,
+    timeout: float = 30,
+    principal: Principal = Depends(authenticate),
+    notifier: ResultNotifier = Depends(get_notifier),
+    cache: PromptCache = Depends(get_prompt_cache),
+):
+    username = principal.username
+    timeout = min(max(timeout, 0), LONG_POLL_MAX_TIMEOUT)
+
+    async with notifier.subscribe(task_id) as done:
+        predictions = await AsyncUserManager.get_prediction_by_id(
+            get_async_url(), task_id, username
+        )
+        if predictions is None:
+            try:
+                await asyncio.wait_for(done, timeout)
+            except asyncio.TimeoutError:
+                pass
+            else:
+                predictions = await AsyncUserManager.get_prediction_by_id(
+                    get_async_url(), task_id, username
+                )
+
+    if predictions is None:
+        raise HTTPException(status_code=400, detail="Task result not found")
+    cache.resolve(task_id, predictions)
+    return {"prediction": predictions}
+
+
+@app.get("/anecdote/{task_id}/stream")
+async def stream_anecdote(
+    task_id: str,
+    principal: Principal = Depends(authenticate),
+    publisher: TaskPublisher = Depends(get_publisher),
+):
+    username = principal.username
+    try:
+        stream = await publisher.open_stream(get_stream_queue_name(username, task_id))
+    except StreamNotFound:
+        raise HTTPException(status_code=404, detail="Task stream not found")
+
+    async def events():
+        done = False
+        try:
+            async for event in stream.iter_events(STREAM_IDLE_TIMEOUT):
+                done = event.get("done", False)
+                yield f"data: {json.dumps(event)}\n\n"
+        except asyncio.TimeoutError:
+            payload = json.dumps({"detail": "Stream timed out"})
+            yield f"event: error\ndata: {payload}\n\n"
+        finally:
+            await stream.close(delete=done)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.get("/cache_stats")
+async def get_cache_stats(
+    principal: Principal = Depends(authenticate),
+    cache: PromptCache = Depends(get_prompt_cache),
+):
+    if not principal.is_admin:
+        raise HTTPException(status_code=400, detail="User not admin")
+    return cache.stats()
+
+
+@app.get("/dead_letters")
+async def get_dead_letters(
+    principal: Principal = Depends(authenticate),
+    publisher: TaskPublisher = Depends(get_publisher),
+):
+    # Глубина очередей мёртвых писем: задачи, исчерпавшие все попытки
+    if not principal.is_admin:
+        raise HTTPException(status_code=400, detail="User not admin")
+    depths = {}
+    try:
+        for spec in MODELS.values():
+            queue = get_dead_letter_queue(spec.queue)
+            depths[spec.model_id], _ = await publisher.queue_stats(queue)
+    except Exception:
+        raise HTTPException(status_code=503, detail="Task queue unavailable")
+    return {"dead_letters": depths, "total": sum(depths.values())}
+
+
+@app.get("/models")
+async def get_models():
+    return [
+        {"model_id": spec.model_id, "name": spec.name, "price": spec.price}
+        for spec in MODELS.values()
+    ]
+
+
+@app.get("/ready")
+async def ready(publisher: TaskPublisher = Depends(get_publisher)):
+    # Воркер подписывается на очереди только после загрузки и прогрева
+    # модели, так что число консьюмеров - это число готовых воркеров
+    workers = {}
+    try:
+        for spec in MODELS.values():
+            _, workers[spec.model_id] = await publisher.queue_stats(spec.queue)
+    except Exception:
+        raise HTTPException(status_code=503, detail="Task queue unavailable")
+    if not any(workers.values()):
+        raise HTTPException(status_code=503, detail="No ready workers")
+    return {"ready": True, "workers": workers}
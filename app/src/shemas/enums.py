@@ -4,3 +4,18 @@ from enum import Enum
 class TransactionType(Enum):
     REPLENISHMENT = "replenishment"
     WITHDRAW = "withdraw"
+    REFUND = "refund"
+
+
+class TaskLane(str, Enum):
+    BULK = "bulk"
+    INTERACTIVE = "interactive"
+    EXPRESS = "express"
+
+
+# Приоритеты сообщений RabbitMQ, не больше TASK_QUEUE_MAX_PRIORITY
+LANE_PRIORITIES = {
+    TaskLane.BULK: 1,
+    TaskLane.INTERACTIVE: 5,
+    TaskLane.EXPRESS: 9,
+}
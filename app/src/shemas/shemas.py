@@ -1,7 +1,9 @@
 from datetime import datetime
 from typing import Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+
+from shemas.enums import TaskLane
 
 
 class UserData(BaseModel):
@@ -26,3 +28,8 @@ class PredictionResponse(BaseModel):
 
 class AnecdoteRequest(BaseModel):
     prompt: str
+    stream: Optional[bool] = False
+    model_id: Optional[int] = 1
+    lane: TaskLane = TaskLane.INTERACTIVE
+    max_new_tokens: Optional[int] = Field(default=None, gt=0)
+    latency_budget_ms: Optional[int] = Field(default=None, gt=0)
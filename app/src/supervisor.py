@@ -0,0 +1,147 @@
+import os
+import signal
+import sys
+import time
+from functools import partial
+from typing import Dict
+
+import torch
+from loguru import logger
+
+from database.database import init_schema, dispose_engines
+from model import (
+    Model,
+    get_ready_file,
+    get_worker_specs,
+    mark_not_ready,
+    run_consumer,
+)
+from registry import ModelPool
+from config import (
+    get_url,
+    MODEL_MEMORY_BUDGET_MB,
+    WORKER_PROCESSES,
+    WORKER_THREADS,
+    WORKER_INTEROP_THREADS,
+)
+
+RESTART_DELAY = 1
+
+
+# Веса грузятся один раз в родителе, а консьюмеры - это fork'и, которые
+# делят их copy-on-write: тензоры после загрузки никто не пишет, так что
+# страницы весов не копируются. Упавшие процессы перезапускаются.
+class Supervisor:
+    def __init__(self, models: ModelPool, processes: int, threads: int):
+        self._models = models
+        self._processes = processes
+        self._threads = threads
+        self._children: Dict[int, int] = {}
+        self._started_at: Dict[int, float] = {}
+        self._stopping = False
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        for slot in range(self._processes):
+            # Файл мог остаться от прошлого запуска контейнера
+            mark_not_ready(get_ready_file(slot))
+            self._spawn(slot)
+
+        while self._children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+
+            slot = self._children.pop(pid, None)
+            if slot is None:
+                continue
+            # Упавший процесс не успел убрать свой файл готовности
+            mark_not_ready(get_ready_file(slot))
+            if self._stopping:
+                continue
+
+            logger.warning(
+                f"Worker {slot} (pid {pid}) exited with status "
+                f"{os.waitstatus_to_exitcode(status)}, restarting"
+            )
+            # Не даём процессу, падающему сразу после старта, крутиться в цикле
+            uptime = time.monotonic() - self._started_at[slot]
+            if uptime < RESTART_DELAY:
+                time.sleep(RESTART_DELAY - uptime)
+            self._spawn(slot)
+
+        for slot in range(self._processes):
+            mark_not_ready(get_ready_file(slot))
+
+    def _spawn(self, slot: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            self._run_child(slot)
+        self._children[pid] = slot
+        self._started_at[slot] = time.monotonic()
+        logger.info(f"Started worker {slot} (pid {pid})")
+
+    def _run_child(self, slot: int) -> None:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        code = 0
+        try:
+            torch.set_num_threads(self._threads)
+            try:
+                torch.set_num_interop_threads(WORKER_INTEROP_THREADS)
+            except RuntimeError as e:
+                logger.warning(f"Cannot set interop threads in worker {slot}: {e}")
+
+            for model in self._models.loaded_models:
+                model.warm_up()
+            run_consumer(self._models, get_ready_file(slot))
+        except KeyboardInterrupt:
+            pass
+        except BaseException as e:
+            logger.exception(e)
+            code = 1
+        finally:
+            os._exit(code)
+
+    def _stop(self, signum, frame) -> None:
+        self._stopping = True
+        for pid in self._children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+
+def main():
+    processes = max(1, WORKER_PROCESSES)
+    threads = WORKER_THREADS or max(1, (os.cpu_count() or 1) // processes)
+
+    # В родителе считаем в один поток: пул потоков OpenMP, поднятый до
+    # fork'а, в дочерних процессах не работает
+    torch.set_num_threads(1)
+
+    init_schema(get_url())
+    models = ModelPool(
+        get_worker_specs(),
+        MODEL_MEMORY_BUDGET_MB,
+        loader=partial(Model.from_spec, warm_up=False),
+    )
+    models.preload()
+    # Соединения с базой не должны достаться детям по наследству
+    dispose_engines()
+
+    logger.info(
+        f"Forking {processes} workers with {threads} threads each, "
+        f"models loaded: {models.loaded_ids}"
+    )
+    Supervisor(models, processes, threads).run()
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
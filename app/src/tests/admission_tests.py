@@ -0,0 +1,64 @@
+import pytest
+
+from ..admission import AdmissionController, QueueOverloaded
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_controller(clock, max_backlog=10):
+    return AdmissionController(
+        max_backlog=max_backlog,
+        depth_ttl=1,
+        window=10,
+        default_retry_after=30,
+        clock=clock,
+    )
+
+
+def test_eta_unknown_without_completions():
+    controller = make_controller(FakeClock())
+    assert controller.check("tasks", depth=5) is None
+
+
+def test_eta_follows_recent_throughput():
+    clock = FakeClock()
+    controller = make_controller(clock)
+    for _ in range(20):
+        controller.record_completion("tasks")
+
+    assert controller.throughput("tasks") == 2
+    assert controller.check("tasks", depth=3) == 2
+
+    clock.now = 11
+    assert controller.throughput("tasks") == 0
+
+
+def test_rejects_above_backlog_with_retry_after():
+    clock = FakeClock()
+    controller = make_controller(clock, max_backlog=10)
+    with pytest.raises(QueueOverloaded) as error:
+        controller.check("tasks", depth=10)
+    assert error.value.retry_after == 30
+
+    for _ in range(10):
+        controller.record_completion("tasks")
+    with pytest.raises(QueueOverloaded) as error:
+        controller.check("tasks", depth=14)
+    assert error.value.retry_after == 5
+
+
+def test_throughput_is_tracked_per_queue():
+    clock = FakeClock()
+    controller = make_controller(clock)
+    for _ in range(20):
+        controller.record_completion("tasks")
+
+    assert controller.throughput("tasks.small") == 0
+    assert controller.check("tasks.small", depth=3) is None
+    assert controller.check("tasks", depth=3) == 2
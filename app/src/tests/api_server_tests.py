@@ -1,7 +1,7 @@
 import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import MagicMock, patch
-import json
+from .. import server
 from ..config import PROMPT_PRICE, get_connection_params
 
 
@@ -50,7 +50,7 @@ def test_get_all_users(context_admin):
         "/all_users", cookies={"access_token": context_admin["token"]}
     )
     assert response.status_code == 200
-    assert isinstance(json.loads(response.json()), list)
+    assert isinstance(response.json(), list)
 
 
 def test_get_user_transactions(context_user):
@@ -60,7 +60,44 @@ def test_get_user_transactions(context_user):
         "/all_transactions", cookies={"access_token": context_user["token"]}
     )
     assert response.status_code == 200
-    assert isinstance(json.loads(response.json()), list)
+    assert isinstance(response.json(), list)
+
+
+def test_get_user_transactions_pagination(context_user):
+    for amount in (1, 2, 3):
+        context_user["client"].post(
+            "/deposit",
+            json={"amount": amount},
+            cookies={"access_token": context_user["token"]},
+        )
+
+    response = context_user["client"].get(
+        "/all_transactions",
+        params={"limit": 2},
+        cookies={"access_token": context_user["token"]},
+    )
+    assert response.status_code == 200
+    first_page = response.json()
+    assert len(first_page) == 2
+    cursor = response.headers["X-Next-Cursor"]
+
+    response = context_user["client"].get(
+        "/all_transactions",
+        params={"limit": 2, "cursor": cursor},
+        cookies={"access_token": context_user["token"]},
+    )
+    assert response.status_code == 200
+    second_page = response.json()
+    assert {t["id"] for t in first_page}.isdisjoint({t["id"] for t in second_page})
+
+
+def test_get_user_transactions_invalid_cursor(context_user):
+    response = context_user["client"].get(
+        "/all_transactions",
+        params={"cursor": "not-a-cursor"},
+        cookies={"access_token": context_user["token"]},
+    )
+    assert response.status_code == 400
 
 
 def test_get_anecdote(context_user):
@@ -89,3 +126,41 @@ def test_get_anecdote(context_user):
     )
     assert response.status_code == 200
     assert "prediction" in response.json()
+
+
+def test_wait_anecdote_result_times_out(context_user):
+    response = context_user["client"].get(
+        "/anecdote/non_existent_task/wait",
+        params={"timeout": 0.1},
+        cookies={"access_token": context_user["token"]},
+    )
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Task result not found"}
+
+
+class CachedAnswer:
+    def get(self, prompt, model_id=1):
+        return "cached joke"
+
+
+def test_cache_hit_refunds_when_prediction_is_not_saved(context_user, monkeypatch):
+    client = context_user["client"]
+    cookies = {"access_token": context_user["token"]}
+
+    async def add_prediction(*args, **kwargs):
+        raise RuntimeError("database is down")
+
+    monkeypatch.setattr(server, "PROMPT_CACHE_ENABLED", True)
+    monkeypatch.setattr(server.AsyncUserManager, "add_prediction", add_prediction)
+    server.app.dependency_overrides[server.get_prompt_cache] = CachedAnswer
+    try:
+        client.post("/deposit", json={"amount": PROMPT_PRICE}, cookies=cookies)
+        balance = client.get("/balance", cookies=cookies).json()
+        response = client.post(
+            "/anecdote", json={"prompt": "tell me joke"}, cookies=cookies
+        )
+    finally:
+        server.app.dependency_overrides.pop(server.get_prompt_cache, None)
+
+    assert response.status_code == 503
+    assert client.get("/balance", cookies=cookies).json() == balance
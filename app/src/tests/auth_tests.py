@@ -0,0 +1,40 @@
+from datetime import datetime, timedelta, timezone
+
+from ..auth import Principal, TokenCache
+
+
+def make_principal(username: str, expires_in: timedelta) -> Principal:
+    return Principal(
+        user_id=1,
+        username=username,
+        is_admin=False,
+        expires_at=datetime.now(timezone.utc) + expires_in,
+    )
+
+
+def test_token_cache_returns_verified_principal():
+    cache = TokenCache(max_size=10)
+    principal = make_principal("test_user", timedelta(days=1))
+    cache.put("token", principal)
+
+    assert cache.get("token") == principal
+    assert cache.get("unknown_token") is None
+
+
+def test_token_cache_drops_expired_tokens():
+    cache = TokenCache(max_size=10)
+    cache.put("token", make_principal("test_user", timedelta(seconds=-1)))
+
+    assert cache.get("token") is None
+
+
+def test_token_cache_is_bounded():
+    cache = TokenCache(max_size=2)
+    cache.put("token1", make_principal("user1", timedelta(days=1)))
+    cache.put("token2", make_principal("user2", timedelta(days=1)))
+    cache.get("token1")
+    cache.put("token3", make_principal("user3", timedelta(days=1)))
+
+    assert cache.get("token2") is None
+    assert cache.get("token1") is not None
+    assert cache.get("token3") is not None
@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from ..benchmarks.runner import Recorder, percentile
+from ..benchmarks.stubs import InMemoryBroker, StreamNotFound
+
+
+def test_percentile_uses_nearest_rank():
+    samples = list(range(1, 101))
+
+    assert percentile(samples, 50) == 50
+    assert percentile(samples, 95) == 95
+    assert percentile(samples, 99) == 99
+    assert percentile([7], 99) == 7
+    assert percentile([], 50) == 0.0
+
+
+def test_recorder_reports_errors_and_throughput():
+    recorder = Recorder()
+    recorder.record("GET /balance", 0.010)
+    recorder.record("GET /balance", 0.030, ok=False)
+
+    report = recorder.report(duration=2)["GET /balance"]
+    assert report["count"] == 2
+    assert report["errors"] == 1
+    assert report["throughput_rps"] == 1
+    assert report["p50_ms"] == 10
+    assert report["p99_ms"] == 30
+
+
+def test_in_memory_broker_serves_higher_priority_first():
+    async def scenario():
+        broker = InMemoryBroker()
+        await broker.publish({"id": "bulk"}, "tasks", priority=1)
+        await broker.publish({"id": "express"}, "tasks", priority=9)
+        assert await broker.queue_stats("tasks") == (2, 0)
+        return [(await broker.get("tasks"))["id"] for _ in range(2)]
+
+    assert asyncio.run(scenario()) == ["express", "bulk"]
+
+
+def test_in_memory_stream_keeps_events_until_opened():
+    async def scenario():
+        broker = InMemoryBroker()
+        with pytest.raises(StreamNotFound):
+            await broker.open_stream("stream.task1")
+
+        await broker.declare_stream("stream.task1")
+        broker.publish_stream_event("stream.task1", {"chunk": "joke "})
+        broker.publish_stream_event("stream.task1", {"done": True})
+        stream = await broker.open_stream("stream.task1")
+        events = [event async for event in stream.iter_events(idle_timeout=1)]
+        await stream.close(delete=True)
+
+        with pytest.raises(StreamNotFound):
+            await broker.open_stream("stream.task1")
+        return events
+
+    assert asyncio.run(scenario()) == [{"chunk": "joke "}, {"done": True}]
@@ -0,0 +1,33 @@
+from ..budget import GenerationPolicy
+
+
+def make_policy() -> GenerationPolicy:
+    return GenerationPolicy(
+        max_new_tokens=200, min_new_tokens=32, max_time=10, pressure_backlog=100
+    )
+
+
+def test_request_budget_is_capped_by_policy():
+    policy = make_policy()
+
+    assert policy.for_request() == {"max_new_tokens": 200}
+    assert policy.for_request(50) == {"max_new_tokens": 50}
+    assert policy.for_request(1000, 60000) == {"max_new_tokens": 200, "max_time": 10}
+    assert policy.for_request(None, 2500) == {"max_new_tokens": 200, "max_time": 2.5}
+
+
+def test_task_budget_is_kept_without_pressure():
+    policy = make_policy()
+    task = {"max_new_tokens": 120, "max_time": 3}
+
+    assert policy.for_task(task, backlog=100) == {"max_new_tokens": 120, "max_time": 3}
+    assert policy.for_task({}, backlog=0) == {"max_new_tokens": 200}
+
+
+def test_task_budget_shrinks_under_pressure():
+    policy = make_policy()
+
+    assert policy.for_task({}, backlog=200) == {"max_new_tokens": 100, "max_time": 10}
+    assert policy.for_task({}, backlog=10000)["max_new_tokens"] == 32
+    small = policy.for_task({"max_new_tokens": 20}, backlog=10000)
+    assert small["max_new_tokens"] == 20
@@ -0,0 +1,66 @@
+from ..cache import PromptCache, normalize_prompt
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_normalize_prompt():
+    assert normalize_prompt("  Tell me  a JOKE\nabout cats ") == (
+        "tell me a joke about cats"
+    )
+
+
+def test_cache_serves_only_full_pool():
+    cache = PromptCache(max_entries=10, ttl=60, pool_size=2)
+    cache.add("tell me a joke", "joke 1")
+    assert cache.get("tell me a joke") is None
+
+    cache.add("Tell me a  joke", "joke 2")
+    assert cache.get("TELL ME A JOKE") in {"joke 1", "joke 2"}
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_cache_expires_entries():
+    clock = FakeClock()
+    cache = PromptCache(max_entries=10, ttl=60, pool_size=1, clock=clock)
+    cache.add("cats", "joke")
+    assert cache.get("cats") == "joke"
+
+    clock.now = 61
+    assert cache.get("cats") is None
+
+
+def test_cache_evicts_least_recently_used():
+    cache = PromptCache(max_entries=2, ttl=60, pool_size=1)
+    cache.add("cats", "joke 1")
+    cache.add("dogs", "joke 2")
+    cache.get("cats")
+    cache.add("birds", "joke 3")
+
+    assert cache.get("dogs") is None
+    assert cache.get("cats") == "joke 1"
+    assert cache.get("birds") == "joke 3"
+
+
+def test_cache_keys_include_model():
+    cache = PromptCache(max_entries=10, ttl=60, pool_size=1)
+    cache.add("cats", "joke", model_id=1)
+
+    assert cache.get("cats", model_id=1) == "joke"
+    assert cache.get("cats", model_id=2) is None
+
+
+def test_cache_resolves_tracked_tasks():
+    cache = PromptCache(max_entries=10, ttl=60, pool_size=1)
+    cache.track("task1", "cats")
+    cache.resolve("task1", "joke")
+    cache.resolve("unknown_task", "other joke")
+
+    assert cache.get("cats") == "joke"
+    assert cache.stats()["pending"] == 0
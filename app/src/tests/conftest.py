@@ -4,9 +4,17 @@ from sqlalchemy import create_engine
 from ..config import get_url
 from ..server import app
 from ..database.models import Base
+from ..database.database import init_schema
 import re
 
-client = TestClient(app)
+
+# Без контекстного менеджера TestClient гоняет каждый запрос в своём
+# event loop'е, а пул asyncpg привязан к тому, где открыто соединение.
+# В with startup/shutdown и все запросы идут в одном loop'е.
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(app) as test_client:
+        yield test_client
 
 
 @pytest.fixture
@@ -17,14 +25,17 @@ def db_url():
 
 @pytest.fixture
 def init_db(db_url):
+    # Схема та же, что поднимает сервер, включая SCHEMA_UPGRADES; API-тесты
+    # пишут в ту же базу, поэтому начинаем с чистых таблиц
     engine = create_engine(db_url)
-    Base.metadata.create_all(engine)
+    Base.metadata.drop_all(engine)
+    init_schema(db_url)
     yield
     Base.metadata.drop_all(engine)
 
 
 @pytest.fixture(name="context_user")
-def auth_user():
+def auth_user(client):
     user_data = {"username": "test_user", "password": "test_password"}
     client.post("/register", json=user_data)
     response = client.post("/login", json=user_data)
@@ -34,7 +45,7 @@ def auth_user():
 
 
 @pytest.fixture(name="context_admin")
-def auth_admin():
+def auth_admin(client):
     admin_user_data = {
         "username": "test_admin",
         "password": "test_password",
@@ -0,0 +1,108 @@
+from types import SimpleNamespace
+
+from .. import consumer as consumer_module
+from ..consumer import BatchConsumer
+from ..database.database import UserManager
+from ..retries import RETRY_COUNT_HEADER, RetryPolicy, get_dead_letter_queue
+
+
+class FakeChannel:
+    def __init__(self):
+        self.calls = []
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.calls.append(("ack", delivery_tag, multiple))
+
+    def basic_nack(self, delivery_tag, requeue=True):
+        self.calls.append(("nack", delivery_tag, requeue))
+
+    def basic_reject(self, delivery_tag, requeue=True):
+        self.calls.append(("reject", delivery_tag, requeue))
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        self.calls.append(("publish", routing_key, properties))
+
+
+class FakeConnection:
+    # Колбэки потока pika выполняем сразу
+    def add_callback_threadsafe(self, callback):
+        callback()
+
+
+def make_consumer(channel):
+    models = SimpleNamespace(specs=[])
+    retries = RetryPolicy(max_attempts=3, base_delay_ms=1000)
+    return BatchConsumer(FakeConnection(), channel, models, 8, 0, retries=retries)
+
+
+def track_last_attempt(consumer, delivery_tag):
+    # Две попытки уже были, эта - последняя
+    properties = SimpleNamespace(headers={RETRY_COUNT_HEADER: 2}, priority=5)
+    consumer._tracker.track(delivery_tag, ("tasks", properties))
+
+
+TASK = {"id": "task1", "username": "test_user", "amount": -10, "prompt": "joke"}
+
+
+def test_released_task_acks_results_saved_behind_it():
+    channel = FakeChannel()
+    consumer = make_consumer(channel)
+    for delivery_tag in (1, 2, 3):
+        consumer._tracker.track(delivery_tag, ("tasks", SimpleNamespace()))
+    assert consumer._tracker.complete([2, 3]) is None
+
+    consumer._requeue(1)
+
+    assert channel.calls == [("nack", 1, True), ("ack", 3, True)]
+
+
+def test_last_failure_refunds_and_dead_letters(monkeypatch):
+    refunds = []
+    monkeypatch.setattr(
+        consumer_module.UserManager,
+        "refund",
+        lambda db_url, *args: refunds.append(args),
+    )
+    channel = FakeChannel()
+    consumer = make_consumer(channel)
+    track_last_attempt(consumer, 1)
+
+    consumer._fail(1, TASK)
+
+    assert refunds == [("test_user", 10, "task1")]
+    (_, queue, properties), ack = channel.calls
+    assert queue == get_dead_letter_queue("tasks")
+    assert properties.headers == {RETRY_COUNT_HEADER: 3}
+    assert ack == ("ack", 1, False)
+
+
+def test_failed_refund_requeues_task(monkeypatch):
+    def refund(db_url, *args):
+        raise RuntimeError("database is down")
+
+    monkeypatch.setattr(consumer_module.UserManager, "refund", refund)
+    channel = FakeChannel()
+    consumer = make_consumer(channel)
+    track_last_attempt(consumer, 1)
+
+    consumer._fail(1, TASK)
+
+    assert channel.calls == [("nack", 1, True)]
+
+
+def test_repeated_failure_refunds_once(init_db, db_url, monkeypatch):
+    monkeypatch.setattr(consumer_module, "get_url", lambda: db_url)
+    UserManager.try_register(db_url, "test_user", "password")
+    UserManager.change_balance(db_url, "test_user", 100)
+    UserManager.change_balance(db_url, "test_user", -10)
+    channel = FakeChannel()
+    consumer = make_consumer(channel)
+
+    # Ack после первого возврата потерялся, и задача пришла снова
+    for delivery_tag in (1, 2):
+        track_last_attempt(consumer, delivery_tag)
+        consumer._fail(delivery_tag, TASK)
+
+    assert UserManager.get_balance(db_url, "test_user") == 100
+    dead_letters = [call for call in channel.calls if call[0] == "publish"]
+    assert len(dead_letters) == 2
@@ -63,6 +63,35 @@ def test_change_balance(init_db, db_url):
         UserManager.change_balance(db_url, "test_user", -100)
 
 
+def test_refund(init_db, db_url):
+    UserManager.try_register(db_url, "test_user", "password")
+    UserManager.change_balance(db_url, "test_user", 100)
+    UserManager.change_balance(db_url, "test_user", -30)
+    UserManager.refund(db_url, "test_user", 30)
+
+    balance = UserManager.get_balance(db_url, "test_user")
+    assert balance == 100
+
+    transactions = json.loads(UserManager.get_user_transactions(db_url, "test_user"))
+    assert [t["transaction_type"] for t in transactions] == [
+        "replenishment",
+        "withdraw",
+        "refund",
+    ]
+
+
+def test_refund_for_task_is_applied_once(init_db, db_url):
+    UserManager.try_register(db_url, "test_user", "password")
+    UserManager.change_balance(db_url, "test_user", 100)
+    UserManager.change_balance(db_url, "test_user", -30)
+    UserManager.refund(db_url, "test_user", 30, "task1")
+    UserManager.refund(db_url, "test_user", 30, "task1")
+
+    assert UserManager.get_balance(db_url, "test_user") == 100
+    transactions = json.loads(UserManager.get_user_transactions(db_url, "test_user"))
+    assert [t["transaction_type"] for t in transactions].count("refund") == 1
+
+
 def test_add_prediction(init_db, db_url):
     UserManager.try_register(db_url, "test_user", "password")
     UserManager.add_prediction(db_url, "task1", "test_user", "prediction1", -10)
@@ -71,6 +100,44 @@ def test_add_prediction(init_db, db_url):
     assert len(json.loads(predictions)) == 1
 
 
+def test_add_predictions(init_db, db_url):
+    UserManager.try_register(db_url, "test_user", "password")
+    UserManager.add_predictions(
+        db_url,
+        [
+            {
+                "task_id": f"task{i}",
+                "username": "test_user",
+                "prediction_result": f"prediction{i}",
+                "amount": -10,
+                "max_new_tokens": 200,
+            }
+            for i in range(3)
+        ],
+    )
+
+    predictions = json.loads(UserManager.get_user_predictions(db_url, "test_user"))
+    assert len(predictions) == 3
+    assert {prediction["max_new_tokens"] for prediction in predictions} == {200}
+
+
+def test_add_prediction_is_idempotent(init_db, db_url):
+    UserManager.try_register(db_url, "test_user", "password")
+    UserManager.add_prediction(db_url, "task1", "test_user", "prediction1", -10)
+    UserManager.add_prediction(db_url, "task1", "test_user", "prediction2", -10)
+
+    predictions = json.loads(UserManager.get_user_predictions(db_url, "test_user"))
+    assert [p["prediction_result"] for p in predictions] == ["prediction1"]
+
+
+def test_get_completed_tasks(init_db, db_url):
+    UserManager.try_register(db_url, "test_user", "password")
+    UserManager.add_prediction(db_url, "task1", "test_user", "prediction1", -10)
+
+    completed = UserManager.get_completed_tasks(db_url, ["task1", "task2"])
+    assert completed == {"task1": "prediction1"}
+
+
 def test_get_user_transactions(init_db, db_url):
     UserManager.try_register(db_url, "test_user", "password")
     UserManager.change_balance(db_url, "test_user", 100)
@@ -0,0 +1,85 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from ..consumer import get_bucket
+from ..prompts import PROMPT_TEMPLATE, PromptEncoder, load_tokenizer
+from ..registry import get_local_dir
+
+
+class FakeTokenizer:
+    eos_token_id = 1
+
+    def __init__(self):
+        self.calls = []
+
+    def _ids(self, text):
+        return [len(word) + 10 for word in text.split()]
+
+    def __call__(self, text, add_special_tokens=True):
+        self.calls.append(text)
+        if isinstance(text, list):
+            return SimpleNamespace(input_ids=[self._ids(item) for item in text])
+        return SimpleNamespace(input_ids=self._ids(text))
+
+
+def test_encoder_matches_full_template():
+    tokenizer = FakeTokenizer()
+    encoder = PromptEncoder(tokenizer)
+    expected = tokenizer._ids(PROMPT_TEMPLATE.format(prompt="tell a joke")) + [1]
+
+    assert encoder.encode("tell a joke") == expected
+    assert encoder.encode_batch(["tell a joke"]) == [expected]
+
+
+def test_encoder_tokenizes_template_once():
+    tokenizer = FakeTokenizer()
+    encoder = PromptEncoder(tokenizer)
+    template_calls = len(tokenizer.calls)
+
+    encoder.encode("first")
+    encoder.encode("second")
+
+    assert tokenizer.calls[template_calls:] == ["first", "second"]
+
+
+def load_t5_tokenizer():
+    # Локальная копия, как у API, иначе хаб; без сети тест пропускается
+    pytest.importorskip("transformers")
+    path = get_local_dir("google/flan-t5-small")
+    if not os.path.isdir(path):
+        path = "google/flan-t5-small"
+    try:
+        return load_tokenizer(path)
+    except Exception as e:
+        pytest.skip(f"T5 tokenizer is not available: {e}")
+
+
+def test_encoder_matches_t5_tokenizer():
+    tokenizer = load_t5_tokenizer()
+    encoder = PromptEncoder(tokenizer)
+    prompts = [
+        "tell a joke about cats",
+        "  leading and trailing spaces  ",
+        "Prompt: nested template words?",
+        "Шутка про программистов",
+        "",
+    ]
+
+    for prompt in prompts:
+        expected = tokenizer(PROMPT_TEMPLATE.format(prompt=prompt)).input_ids
+        assert encoder.encode(prompt) == expected
+    assert encoder.encode_batch(prompts) == [
+        tokenizer(PROMPT_TEMPLATE.format(prompt=prompt)).input_ids
+        for prompt in prompts
+    ]
+
+
+def test_bucket_by_length():
+    bounds = [64, 128, 256]
+    assert get_bucket(10, bounds) == 0
+    assert get_bucket(64, bounds) == 0
+    assert get_bucket(65, bounds) == 1
+    assert get_bucket(256, bounds) == 2
+    assert get_bucket(1000, bounds) == 3
@@ -0,0 +1,48 @@
+import pytest
+
+from ..registry import ModelPool, ModelSpec
+
+
+def make_spec(model_id: int, memory_mb: int) -> ModelSpec:
+    return ModelSpec(
+        model_id=model_id,
+        name=f"model-{model_id}",
+        path=f"path/model-{model_id}",
+        price=10,
+        queue=f"queue-{model_id}",
+        memory_mb=memory_mb,
+    )
+
+
+def test_pool_loads_lazily_and_reuses_models():
+    loaded = []
+    pool = ModelPool(
+        [make_spec(1, 100), make_spec(2, 100)],
+        memory_budget_mb=1000,
+        loader=lambda spec: loaded.append(spec.model_id) or spec.name,
+    )
+    assert loaded == []
+
+    assert pool.get(1) == "model-1"
+    assert pool.get(1) == "model-1"
+    assert loaded == [1]
+
+
+def test_pool_evicts_least_recently_used_model():
+    pool = ModelPool(
+        [make_spec(1, 400), make_spec(2, 400), make_spec(3, 400)],
+        memory_budget_mb=1000,
+        loader=lambda spec: spec.name,
+    )
+    pool.get(1)
+    pool.get(2)
+    pool.get(1)
+    pool.get(3)
+
+    assert pool.loaded_ids == [1, 3]
+
+
+def test_pool_rejects_unknown_model():
+    pool = ModelPool([make_spec(1, 100)], memory_budget_mb=1000, loader=str)
+    with pytest.raises(KeyError):
+        pool.get(2)
@@ -0,0 +1,91 @@
+from .. import results
+from ..results import AckTracker, ResultWriter
+
+
+def test_watermark_waits_for_earlier_tasks():
+    tracker = AckTracker()
+    for delivery_tag in (1, 2, 3):
+        tracker.track(delivery_tag)
+
+    assert tracker.complete([2, 3]) is None
+    assert tracker.complete([1]) == 3
+
+
+def test_settled_tasks_do_not_hold_watermark():
+    tracker = AckTracker()
+    for delivery_tag in (1, 2, 3, 4):
+        tracker.track(delivery_tag)
+
+    tracker.settle(1)
+    assert tracker.complete([2]) == 2
+    assert tracker.complete([4]) is None
+    tracker.settle(3)
+    assert tracker.complete([]) == 4
+    assert tracker.complete([]) is None
+
+
+def test_tracker_forgets_delivery_once_settled():
+    tracker = AckTracker()
+    tracker.track(1, ("tasks", None))
+    tracker.track(2, ("tasks", None))
+
+    assert tracker.delivery(1) == ("tasks", None)
+    tracker.settle(1)
+    tracker.complete([2])
+    assert tracker.delivery(1) is None
+    assert tracker.delivery(2) is None
+
+
+class FakeChannel:
+    def __init__(self):
+        self.acks = []
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.acks.append(delivery_tag)
+
+
+class FakeConnection:
+    def add_callback_threadsafe(self, callback):
+        callback()
+
+
+def test_failed_flush_falls_back_to_single_rows(monkeypatch):
+    saved = []
+
+    def add_predictions(db_url, rows):
+        if len(rows) > 1 or rows[0]["task_id"] == "bad":
+            raise RuntimeError("insert failed")
+        saved.extend(row["task_id"] for row in rows)
+
+    monkeypatch.setattr(results.UserManager, "add_predictions", add_predictions)
+    tracker = AckTracker()
+    channel = FakeChannel()
+    failed = []
+
+    def on_failure(delivery_tag, task):
+        # Как BatchConsumer._fail: задача уходит на повтор и больше
+        # не держит ack'и
+        failed.append(delivery_tag)
+        tracker.settle(delivery_tag)
+
+    writer = ResultWriter(
+        FakeConnection(),
+        channel,
+        tracker,
+        flush_size=10,
+        flush_interval_ms=0,
+        on_failure=on_failure,
+    )
+    for delivery_tag in (1, 2, 3):
+        tracker.track(delivery_tag)
+
+    writer._flush(
+        [
+            (delivery_tag, {"id": task_id, "username": "u", "amount": -10}, "a", None)
+            for delivery_tag, task_id in enumerate(["ok1", "bad", "ok2"], start=1)
+        ]
+    )
+
+    assert saved == ["ok1", "ok2"]
+    assert failed == [2]
+    assert channel.acks == [3]
@@ -0,0 +1,26 @@
+from ..retries import RetryPolicy, get_dead_letter_queue
+
+
+def test_retries_back_off_exponentially():
+    policy = RetryPolicy(max_attempts=3, base_delay_ms=1000)
+
+    assert [policy.delay_ms(attempt) for attempt in (1, 2, 3)] == [1000, 2000, 4000]
+    assert policy.should_retry(1)
+    assert policy.should_retry(2)
+    assert not policy.should_retry(3)
+
+
+def test_retry_queue_dead_letters_back_to_task_queue():
+    policy = RetryPolicy(max_attempts=3, base_delay_ms=500)
+
+    assert policy.retry_queue("tasks", 2) == "tasks.retry.1000"
+    assert policy.retry_queue_arguments("tasks", 2) == {
+        "x-message-ttl": 1000,
+        "x-dead-letter-exchange": "",
+        "x-dead-letter-routing-key": "tasks",
+    }
+    assert get_dead_letter_queue("tasks") == "tasks.dead"
+
+
+def test_single_attempt_never_retries():
+    assert not RetryPolicy(max_attempts=0, base_delay_ms=1000).should_retry(1)
@@ -7,3 +7,5 @@ SECRET_KEY = os.getenv("JWT_SECRET")
 ALGORITHM = os.getenv("JWT_ALGORITHM")
 
 BASE_URL = "http://localhost:8080"
+LONG_POLL_TIMEOUT = 30
+HISTORY_PAGE_SIZE = 200
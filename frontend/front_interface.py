@@ -1,9 +1,7 @@
 import streamlit as st
 import requests
-from jose import jwt, JWTError
 import json
-from config import SECRET_KEY, ALGORITHM, BASE_URL
-import time
+from config import BASE_URL, LONG_POLL_TIMEOUT, HISTORY_PAGE_SIZE
 
 
 def register_user(username, password, is_admin):
@@ -26,22 +24,61 @@ def get_all_users():
     return response.json()
 
 
+def get_models():
+    url = f"{BASE_URL}/models"
+    response = requests.get(url)
+    return response.json()
+
+
+def get_all_pages(url: str, token: str):
+    # История отдаётся страницами: идём по X-Next-Cursor до последней
+    items = []
+    params = {"limit": HISTORY_PAGE_SIZE}
+    while True:
+        response = requests.get(url, params=params, cookies={"access_token": token})
+        if not response.ok:
+            return items
+        items.extend(response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return items
+        params["cursor"] = cursor
+
+
 def get_transaction_history(token: str):
-    url = f"{BASE_URL}/all_transactions"
-    response = requests.get(url, cookies={"access_token": token})
-    return json.loads(response.json())
+    return get_all_pages(f"{BASE_URL}/all_transactions", token)
+
 
+def get_predictions(token: str):
+    return get_all_pages(f"{BASE_URL}/predictions", token)
 
-def is_admin(token: str):
-    try:
-        payload = jwt.decode(token, key=SECRET_KEY, algorithms=[ALGORITHM])
-        return payload["is_admin"]
-    except JWTError:
-        return False
+
+def stream_anecdote(token: str, task_id: str):
+    url = f"{BASE_URL}/anecdote/{task_id}/stream"
+    with requests.get(url, cookies={"access_token": token}, stream=True) as response:
+        if response.status_code != 200:
+            # Ошибка приходит обычным JSON, а не потоком событий
+            try:
+                detail = response.json()["detail"]
+            except (ValueError, KeyError):
+                detail = f"Stream failed with status {response.status_code}"
+            st.error(detail)
+            return
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data: "):
+                continue
+            event = json.loads(line[len("data: ") :])
+            if "chunk" in event:
+                yield event["chunk"]
+            elif "detail" in event:
+                st.error(event["detail"])
+                return
 
 
 if "token" not in st.session_state:
     st.session_state.token = None
+if "is_admin" not in st.session_state:
+    st.session_state.is_admin = False
 if "show_register" not in st.session_state:
     st.session_state.show_register = True
 if "show_login" not in st.session_state:
@@ -104,6 +141,9 @@ if (
                     result = login_user(login_username, login_password)
                     if "access_token" in result:
                         st.session_state.token = result["access_token"]
+                        # Флаг админа приходит вместе с токеном, так что
+                        # расшифровывать JWT на каждом перерендере не нужно
+                        st.session_state.is_admin = result.get("is_admin", False)
                         st.session_state.show_register = False
                         st.session_state.show_login = False
                         st.success("Logged in successfully!")
@@ -153,9 +193,7 @@ if (
 
 
     if st.button("Get Predictions", key="get_predictions_button"):
-        url = f"{BASE_URL}/predictions"
-        response = requests.get(url, cookies={"access_token": st.session_state.token})
-        predictions = json.loads(response.json())
+        predictions = get_predictions(st.session_state.token)
         if predictions:
             st.dataframe(predictions)
         else:
@@ -164,11 +202,31 @@ if (
 
     with st.container(border=True):
         prompt = st.text_input("Запрос", key="anecdote_prompt")
+        models = get_models()
+        model = st.selectbox(
+            "Model",
+            models,
+            format_func=lambda model: f"{model['name']} ({model['price']})",
+            key="anecdote_model",
+        )
+        lane = st.radio(
+            "Lane",
+            ["interactive", "express", "bulk"],
+            horizontal=True,
+            help="express is processed first for an extra fee",
+            key="anecdote_lane",
+        )
+        stream = st.checkbox("Stream the answer", key="anecdote_stream")
         if st.button("Get Anecdote", key="get_anecdote_button"):
             url = f"{BASE_URL}/anecdote"
             response = requests.post(
                 url,
-                json={"prompt": prompt},
+                json={
+                    "prompt": prompt,
+                    "stream": stream,
+                    "model_id": model["model_id"],
+                    "lane": lane,
+                },
                 cookies={"access_token": st.session_state.token},
             )
             if response.status_code != 200:
@@ -177,12 +235,24 @@ if (
                 st.error(content["detail"])
             else:
                 task_id = response.json().get("task_id")
-                if task_id:
+                eta = response.json().get("eta_seconds")
+                if eta:
+                    st.caption(f"Estimated wait: {eta:.0f} s")
+                if task_id and stream:
+                    st.write_stream(stream_anecdote(st.session_state.token, task_id))
+                    st.success("Result received!")
+                elif task_id:
                     with st.spinner("Processing the prompt..."):
                         while True:
-                            url = f"{BASE_URL}/anecdote/{task_id}"
+                            # Сервер сам держит запрос, пока воркер не
+                            # сохранит результат, так что спать между
+                            # запросами не нужно
+                            url = f"{BASE_URL}/anecdote/{task_id}/wait"
                             response = requests.get(
-                                url, cookies={"access_token": st.session_state.token}
+                                url,
+                                params={"timeout": LONG_POLL_TIMEOUT},
+                                cookies={"access_token": st.session_state.token},
+                                timeout=LONG_POLL_TIMEOUT + 10,
                             )
                             answer = response.json()
                             if answer is not None and answer.get("prediction", False):
@@ -193,7 +263,7 @@ if (
                                 "detail" in answer
                                 and answer["detail"] == "Task result not found"
                             ):
-                                time.sleep(5)
+                                continue
                             else:
                                 st.error(
                                     "An error occurred while retrieving the result."
@@ -202,13 +272,13 @@ if (
                 else:
                     st.error("Failed to send request!")
 
-    if is_admin(st.session_state.token):
+    if st.session_state.is_admin:
         if st.button("Get all users", key="get_all_users_button"):
             url = f"{BASE_URL}/all_users"
             response = requests.get(
                 url, cookies={"access_token": st.session_state.token}
             )
-            predictions = json.loads(response.json())
+            predictions = response.json()
             if predictions:
                 st.dataframe(predictions)
             else: